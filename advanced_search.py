@@ -4,7 +4,6 @@ import plotly.express as px
 from datetime import datetime
 import json
 import re
-import google.generativeai as genai
 
 # --- Advanced Search Tool ---
 # This tool provides advanced search capabilities for legal research
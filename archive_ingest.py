@@ -0,0 +1,185 @@
+import hashlib
+import itertools
+import os
+import posixpath
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+
+import extraction_jobs
+import extractors
+
+# --- Bulk Archive Ingestion ---
+# Ingests a ZIP archive of case files: members are streamed out of the archive
+# into memory (nothing is unpacked to disk), identical members are skipped by
+# content hash, and the rest are dispatched to the background extraction pool,
+# which parses each member whole in the process pool.
+# Only a bounded number of members is held in memory at once.
+
+# Members read ahead of the extraction workers; bounds memory for large archives
+MAX_IN_FLIGHT = int(os.environ.get("ZIP_MAX_IN_FLIGHT", str(2 * extraction_jobs.JOB_WORKERS)))
+# Members larger than this (uncompressed) are skipped, which also guards against zip bombs
+MAX_MEMBER_BYTES = int(os.environ.get("ZIP_MAX_MEMBER_MB", "200")) * 1024 * 1024
+# Finished ingests whose results were never collected are dropped after this many seconds
+INGEST_RETENTION_SECONDS = int(os.environ.get("ZIP_INGEST_RETENTION_SECONDS", str(extraction_jobs.JOB_RETENTION_SECONDS)))
+
+
+@dataclass
+class ArchiveIngest:
+    """Progress and results of ingesting one archive."""
+    id: int
+    name: str
+    total: int = 0  # Supported members found in the archive
+    dispatched: int = 0
+    duplicates: list = field(default_factory=list)  # (member, member it duplicates)
+    skipped: list = field(default_factory=list)  # (member, reason)
+    results: dict = field(default_factory=dict)  # member -> document_store id
+    errors: dict = field(default_factory=dict)  # member -> error message
+    bytes_read: int = 0  # Uncompressed bytes of the unique members
+    started_at: float = field(default_factory=time.time)
+    finished_at: float = None
+    error: str = None  # Set if the archive itself could not be read
+    cancel_requested: bool = False
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def completed(self):
+        """Members whose extraction has finished, successfully or not."""
+        return len(self.results) + len(self.errors)
+
+    def throughput(self):
+        """Returns (files per second, MB per second) over the whole ingestion so far."""
+        elapsed = max((self.finished_at or time.time()) - self.started_at, 1e-6)
+        return self.completed / elapsed, self.bytes_read / (1024 * 1024) / elapsed
+
+
+_ingests = {}  # ingest id -> ArchiveIngest
+_ingests_lock = threading.Lock()
+_ingest_ids = itertools.count(1)
+
+
+def _ignored_reason(member_name):
+    """Returns why a member is ignored, for metadata that archivers add (e.g. __MACOSX/, .DS_Store), or None."""
+    parts = [part for part in member_name.split("/") if part not in ("", ".", "..")]  # "./d/a.pdf" is d/a.pdf
+    if "__MACOSX" in parts:
+        return "archiver metadata"
+    if any(part.startswith(".") for part in parts):
+        return "hidden file"
+    return None
+
+
+def _read_member(archive, info):
+    """Decompresses a member straight from the archive stream, returning its bytes and SHA-256 digest."""
+    with archive.open(info) as member:
+        content = member.read()
+    return content, hashlib.sha256(content).hexdigest()
+
+
+def _ingest(ingest, spooled):
+    slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+    dispatched = []  # job ids, cancelled if the archive turns out to be unreadable
+
+    def on_done(job, member_name):
+        if job.status == extraction_jobs.DONE:
+            ingest.results[member_name] = job.doc_id
+        else:
+            ingest.errors[member_name] = job.error or job.status
+        extraction_jobs.forget(job.id)
+        slots.release()
+
+    try:
+        with spooled.open() as stream, zipfile.ZipFile(stream) as archive:
+            members = []
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                ignored = _ignored_reason(info.filename)
+                mime_type = extractors.mime_type_for_extension(posixpath.splitext(info.filename)[1])
+                if ignored:
+                    ingest.skipped.append((info.filename, ignored))
+                elif mime_type is None:
+                    ingest.skipped.append((info.filename, "unsupported type"))
+                elif not extractors.is_supported(mime_type):
+                    ingest.skipped.append((info.filename, "library missing"))
+                elif info.file_size > MAX_MEMBER_BYTES:
+                    ingest.skipped.append((info.filename, f"larger than {MAX_MEMBER_BYTES // (1024 * 1024)} MB"))
+                else:
+                    members.append((info, mime_type))
+            ingest.total = len(members)
+
+            seen = {}  # content hash -> first member with that content
+            for info, mime_type in members:
+                if ingest.cancel_requested:
+                    break
+                slots.acquire()  # Wait until a worker frees up before reading more into memory
+                try:
+                    content, digest = _read_member(archive, info)
+                except (RuntimeError, NotImplementedError, zipfile.BadZipFile) as e:
+                    # Encrypted members, unsupported compression methods, corrupt data
+                    ingest.skipped.append((info.filename, str(e)))
+                    slots.release()
+                    continue
+                if digest in seen:
+                    ingest.duplicates.append((info.filename, seen[digest]))
+                    slots.release()
+                    continue
+                seen[digest] = info.filename
+                ingest.bytes_read += len(content)
+                dispatched.append(extraction_jobs.submit(
+                    content, mime_type, name=info.filename, bulk=True,
+                    on_done=lambda job, member_name=info.filename: on_done(job, member_name),
+                ))
+                ingest.dispatched += 1
+
+        # Wait for the last extractions so throughput covers the whole archive
+        for _ in range(MAX_IN_FLIGHT):
+            slots.acquire()
+    except (zipfile.BadZipFile, OSError) as e:
+        ingest.error = f"Could not read archive: {e}"
+        for job_id in dispatched:
+            extraction_jobs.cancel(job_id)
+    finally:
+        spooled.close()
+        ingest.finished_at = time.time()
+
+
+def start_zip_ingest(spooled, name=None):
+    """Starts ingesting a spooled ZIP archive in the background and returns the ingest id."""
+    _prune()
+    ingest = ArchiveIngest(id=next(_ingest_ids), name=name or spooled.name)
+    with _ingests_lock:
+        _ingests[ingest.id] = ingest
+    threading.Thread(target=_ingest, args=(ingest, spooled), name=f"zip-ingest-{ingest.id}", daemon=True).start()
+    return ingest.id
+
+
+def get_ingest(ingest_id):
+    """Returns the archive ingest with this id, or None."""
+    with _ingests_lock:
+        return _ingests.get(ingest_id)
+
+
+def cancel(ingest_id):
+    """Stops reading further members; extractions already dispatched still finish."""
+    ingest = get_ingest(ingest_id)
+    if ingest is not None:
+        ingest.cancel_requested = True
+
+
+def forget(ingest_id):
+    """Removes a finished ingest once its results have been collected."""
+    with _ingests_lock:
+        ingest = _ingests.get(ingest_id)
+        if ingest is not None and ingest.finished:
+            del _ingests[ingest_id]
+
+
+def _prune():
+    cutoff = time.time() - INGEST_RETENTION_SECONDS
+    with _ingests_lock:
+        for ingest_id in [i.id for i in _ingests.values() if i.finished and i.finished_at < cutoff]:
+            del _ingests[ingest_id]
@@ -0,0 +1,233 @@
+import asyncio
+import csv
+import io
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+import llm_telemetry
+import response_cache
+from legal_prompts import provision_prompt
+
+# --- Batch Provision Lookup ---
+# Looks up many legal provisions at once. Batches run on one asyncio event
+# loop in a background thread (the Gemini async client stays bound to that
+# loop across batches); a per-batch semaphore bounds how many requests are
+# in flight, and each answer is streamed into its item as it arrives so the UI
+# can show results while the rest are still running. Answers go through the
+# shared response cache, so sections looked up before return immediately.
+
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "5"))
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "200"))
+# Finished batches that no session forgot are dropped after this many seconds
+BATCH_RETENTION_SECONDS = int(os.environ.get("BATCH_RETENTION_SECONDS", "3600"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+@dataclass
+class BatchItem:
+    """One provision of a batch and its answer."""
+    term: str
+    status: str = QUEUED
+    chunks: list = field(default_factory=list)
+    started_at: float = None
+    first_chunk_at: float = None
+    finished_at: float = None
+    error: str = None
+    cached: bool = False
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    @property
+    def latency(self):
+        """Seconds from sending the request to the complete answer, or None if not finished."""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+@dataclass
+class BatchLookup:
+    """A batch of provision lookups and their progress."""
+    id: int
+    items: list
+    concurrency: int
+    force_refresh: bool = False
+    started_at: float = field(default_factory=time.time)
+    finished_at: float = None
+    cancel_requested: bool = False
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def completed(self):
+        return sum(1 for item in self.items if item.status in (DONE, FAILED, CANCELLED))
+
+
+_batches = {}  # batch id -> BatchLookup
+_batches_lock = threading.Lock()
+_batch_ids = itertools.count(1)
+_loop = None
+
+
+def _get_loop():
+    global _loop
+    with _batches_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="provision-batches", daemon=True).start()
+        return _loop
+
+
+def parse_terms(text="", csv_content=None):
+    """Returns the provisions to look up from pasted text (one per line) and/or CSV content.
+
+    For CSV, a column named section/provision/term is used if there is one, otherwise the
+    first column. Duplicates (after query normalization) are dropped, keeping the first.
+    """
+    terms = [line.strip() for line in text.splitlines()]
+    if csv_content:
+        rows = list(csv.reader(io.StringIO(bytes(csv_content).decode("utf-8-sig", errors="replace"))))
+        column = 0
+        if rows:
+            header = [cell.strip().lower() for cell in rows[0]]
+            for name in ("section", "provision", "term"):
+                if name in header:
+                    column = header.index(name)
+                    rows = rows[1:]
+                    break
+        terms.extend(row[column].strip() for row in rows if len(row) > column)
+    unique, seen = [], set()
+    for term in terms:
+        normalized = response_cache.normalize_query(term)
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            unique.append(term)
+    return unique
+
+
+async def _lookup(batch, item, model, semaphore):
+    async with semaphore:
+        if batch.cancel_requested:
+            item.status = CANCELLED
+            return
+        item.status = RUNNING
+        item.started_at = time.time()
+        cache_key = response_cache.cache_key("provision", [item.term], model.model_name)
+        cached = None if batch.force_refresh else response_cache.get(cache_key)
+        timer = None
+        try:
+            if cached:
+                item.chunks.append(cached["text"])
+                item.cached = True
+            else:
+                prompt = provision_prompt(item.term)
+                timer = llm_telemetry.CallTimer("provision-batch", model.model_name, prompt)
+                response = await model.generate_content_async(prompt, stream=True)
+                async for chunk in response:
+                    if batch.cancel_requested:
+                        item.status = CANCELLED
+                        timer.finish(cancelled=True)
+                        return
+                    timer.add_usage(getattr(chunk, "usage_metadata", None))
+                    if chunk.parts:
+                        if item.first_chunk_at is None:
+                            item.first_chunk_at = time.time()
+                        timer.add_text(chunk.text)
+                        item.chunks.append(chunk.text)
+                timer.finish()
+                response_cache.put(cache_key, item.text)
+            item.status = DONE
+        except Exception as e:
+            item.error = str(e)
+            item.status = FAILED
+            if timer is not None:
+                timer.finish(error=e)
+        finally:
+            item.finished_at = time.time()
+
+
+async def _run_batch(batch, model):
+    try:
+        semaphore = asyncio.Semaphore(batch.concurrency)
+        await asyncio.gather(*(_lookup(batch, item, model, semaphore) for item in batch.items))
+    finally:
+        for item in batch.items:
+            if item.status == QUEUED:
+                item.status = CANCELLED
+        batch.finished_at = time.time()
+
+
+def start_batch(terms, model, concurrency=BATCH_CONCURRENCY, force_refresh=False):
+    """Starts looking up provisions in the background and returns the batch id."""
+    _prune()
+    batch = BatchLookup(
+        id=next(_batch_ids),
+        items=[BatchItem(term) for term in terms[:MAX_BATCH_ITEMS]],
+        concurrency=max(1, concurrency),
+        force_refresh=force_refresh,
+    )
+    with _batches_lock:
+        _batches[batch.id] = batch
+    asyncio.run_coroutine_threadsafe(_run_batch(batch, model), _get_loop())
+    return batch.id
+
+
+def get_batch(batch_id):
+    """Returns the batch with this id, or None."""
+    with _batches_lock:
+        return _batches.get(batch_id)
+
+
+def cancel(batch_id):
+    """Stops a batch; items already answered are kept."""
+    batch = get_batch(batch_id)
+    if batch is not None:
+        batch.cancel_requested = True
+
+
+def forget(batch_id):
+    """Removes a batch, cancelling it first if it is still running."""
+    with _batches_lock:
+        batch = _batches.pop(batch_id, None)
+    if batch is not None:
+        batch.cancel_requested = True
+
+
+def _prune():
+    cutoff = time.time() - BATCH_RETENTION_SECONDS
+    with _batches_lock:
+        for batch_id in [b.id for b in _batches.values() if b.finished and b.finished_at < cutoff]:
+            del _batches[batch_id]
+
+
+def to_markdown(batch):
+    """Exports a batch as one Markdown document (Notion-ready), with per-item latency."""
+    lines = [
+        "# Legal Provision Lookup",
+        "",
+        f"_{len(batch.items)} provisions · generated {time.strftime('%Y-%m-%d %H:%M', time.localtime(batch.started_at))}_",
+        "",
+    ]
+    for item in batch.items:
+        lines.append(f"## {item.term}")
+        lines.append("")
+        if item.latency is not None:
+            source = "cached" if item.cached else f"{item.latency:.1f}s"
+            lines.append(f"_Latency: {source}_")
+            lines.append("")
+        if item.status == DONE:
+            lines.append(item.text.strip())
+        elif item.status == FAILED:
+            lines.append(f"> Lookup failed: {item.error}")
+        else:
+            lines.append(f"> Not looked up ({item.status}).")
+        lines.append("")
+    return "\n".join(lines)
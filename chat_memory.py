@@ -0,0 +1,106 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import context_packer
+import llm_telemetry
+
+# --- Conversation Memory ---
+# Bounds what General Chat sends about earlier turns: the last RECENT_MESSAGES
+# messages are kept verbatim, and older ones are folded into a rolling summary.
+# After each answer, messages that have left the verbatim window are merged
+# into the summary by a background LLM call, so the next question does not
+# wait for it. Until the summary has caught up, those messages are still sent
+# verbatim (oldest dropped first if they do not fit), so nothing is lost when
+# summarizing is slow or fails. The summary and the turns are packed together
+# into the history share of the tab's token budget (see context_packer.py).
+
+RECENT_MESSAGES = int(os.environ.get("CHAT_MEMORY_RECENT_MESSAGES", "6"))  # 3 question/answer turns
+# Summarize only once this many messages have left the verbatim window, to batch LLM calls
+SUMMARY_BATCH_MESSAGES = int(os.environ.get("CHAT_MEMORY_SUMMARY_BATCH", "4"))
+SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_MEMORY_SUMMARY_MAX_TOKENS", "800"))
+SUMMARY_WORKERS = int(os.environ.get("CHAT_MEMORY_SUMMARY_WORKERS", "2"))
+
+SUMMARY_LABEL = "Summary of the earlier conversation"
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and a legal research assistant (Indian law).
+Update the summary with the new messages below. Keep the facts, names, sections, cases, dates, figures and open questions the user may refer back to; drop pleasantries and repetition.
+Write at most {max_words} words of plain prose. Reply with the updated summary only.
+
+--- CURRENT SUMMARY ---
+{summary}
+--- NEW MESSAGES ---
+{messages}
+"""
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="chat-memory")
+
+
+@dataclass
+class ConversationMemory:
+    """Rolling summary of a session's chat messages; lives in session state."""
+    summary: str = ""
+    summarized: int = 0  # Number of leading messages folded into summary
+    updating: bool = False
+    last_error: str = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+
+def _render(messages):
+    return "\n\n".join(f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in messages)
+
+
+def memory_pieces(memory, messages):
+    """Returns the summary piece (or None) and the message pieces not covered by it, oldest first."""
+    with memory._lock:
+        summary, summarized = memory.summary, memory.summarized
+    turns = [
+        context_packer.Piece("User" if m["role"] == "user" else "Assistant", m["content"])
+        for m in messages[summarized:]
+    ]
+    return (context_packer.Piece(SUMMARY_LABEL, summary) if summary else None), turns
+
+
+def _summarize(memory, model, messages, upto):
+    with memory._lock:
+        summary, start = memory.summary, memory.summarized
+    prompt = SUMMARY_PROMPT.format(
+        max_words=int(SUMMARY_MAX_TOKENS * 0.75),
+        summary=summary or "(none yet)",
+        messages=_render(messages[start:upto]),
+    )
+    timer = llm_telemetry.CallTimer("summary", model.model_name, prompt)
+    try:
+        response = model.generate_content(prompt)
+        text = response.text.strip()
+        timer.finish(output_text=text)
+    except Exception as e:
+        timer.finish(error=e)
+        with memory._lock:
+            memory.updating = False
+            memory.last_error = str(e)
+        return
+    # Hard cap in case the model ignores the word limit
+    text = text[: SUMMARY_MAX_TOKENS * 4]
+    with memory._lock:
+        if memory.summarized == start:  # Not advanced by another update meanwhile
+            memory.summary = text
+            memory.summarized = upto
+        memory.updating = False
+        memory.last_error = None
+
+
+def schedule_update(memory, model, messages):
+    """Folds messages that left the verbatim window into the summary in the background.
+
+    Does nothing while an update is running or until SUMMARY_BATCH_MESSAGES messages are due.
+    Returns True if an update was started.
+    """
+    upto = len(messages) - RECENT_MESSAGES
+    with memory._lock:
+        if memory.updating or upto - memory.summarized < SUMMARY_BATCH_MESSAGES:
+            return False
+        memory.updating = True
+    _executor.submit(_summarize, memory, model, list(messages), upto)
+    return True
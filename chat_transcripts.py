@@ -0,0 +1,64 @@
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+# --- Chat Transcripts ---
+# Each chat is appended message by message to a JSONL file named after its
+# chat id, which the app keeps in the page URL (?chat=...). Reloading the page
+# (or opening the same URL later) restores the conversation from disk, and
+# appending never rewrites earlier messages, so long conversations cost the
+# same to save as short ones. Clearing the chat starts a new id; old
+# transcripts stay on disk.
+
+TRANSCRIPT_DIR = os.environ.get("CHAT_TRANSCRIPT_DIR", os.path.join(".cache", "transcripts"))
+
+_CHAT_ID_RE = re.compile(r"^[0-9a-f]{16,64}$")
+_lock = threading.Lock()
+
+
+def new_chat_id():
+    """Returns a new random chat id."""
+    return secrets.token_hex(12)
+
+
+def is_valid_chat_id(chat_id):
+    """Chat ids come from the URL, so only plain hex ids are accepted as file names."""
+    return bool(chat_id) and bool(_CHAT_ID_RE.match(chat_id))
+
+
+def _path(chat_id):
+    return os.path.join(TRANSCRIPT_DIR, f"{chat_id}.jsonl")
+
+
+def append(chat_id, message):
+    """Appends one message dict (role, content and optional usage) to the chat's transcript."""
+    record = dict(message, saved_at=time.time())
+    try:
+        os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+        with _lock, open(_path(chat_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError:
+        pass  # The chat still works; it just won't survive a reload
+
+
+def load(chat_id):
+    """Returns the messages of a chat, oldest first (an empty list for unknown chats).
+
+    A line cut short by a crash while writing is skipped.
+    """
+    messages = []
+    try:
+        with open(_path(chat_id), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                record.pop("saved_at", None)
+                messages.append(record)
+    except OSError:
+        pass
+    return messages
@@ -0,0 +1,141 @@
+import collections
+import dataclasses
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+
+import context_packer
+import document_store
+
+# --- Combined Context Builder ---
+# The full-document chat context only changes when a document is added or
+# removed, so it is packed and rendered once per set of documents and budget
+# and memoized, shared by all sessions. Reruns and follow-up questions reuse
+# the same DocumentContext handle instead of re-slicing and re-joining the
+# text. On a change only the final join is redone: document texts and their
+# token estimates come from the document store cache and the estimator cache.
+
+MEMO_SIZE = int(os.environ.get("CONTEXT_MEMO_SIZE", "16"))
+
+
+@dataclass(frozen=True)
+class ContextSpan:
+    """Where one packed document's text sits in the rendered context."""
+    label: str
+    start: int
+    end: int
+    tokens: int
+    truncated: bool = False
+    doc_id: str = None
+
+
+@dataclass(frozen=True)
+class DocumentContext:
+    """Packed and rendered file context for one set of documents and budget."""
+    text: str
+    tokens: int
+    budget: int
+    pieces: tuple = ()  # ContextSpan of each packed document
+    dropped: tuple = ()  # Labels of documents that did not fit at all
+    fingerprint: str = None  # Identifies memoized contexts, whose text is stable (see context_cache.py)
+
+
+@dataclass
+class PromptContext:
+    """The context sent with one question and what went into it."""
+    text: str
+    tokens: int
+    history_turns: int = 0
+    documents: object = None  # DocumentContext of the file part, if the full documents were used
+    history_text: str = ""
+
+
+_memo = collections.OrderedDict()  # (frozenset of (filename, doc_id), budget) -> DocumentContext
+_memo_lock = threading.Lock()
+_memo_stats = {"hits": 0, "misses": 0}
+
+
+def render_documents(pieces, spans=None):
+    """Renders packed document pieces as the file section of the context.
+
+    If spans is a list, a ContextSpan locating each piece's text is appended to it.
+    """
+    if not pieces:
+        return ""
+    parts = ["Context from Uploaded Files:\n"]
+    offset = len(parts[0])
+    for piece in pieces:
+        header = f"--- Start {piece.label} ---\n"
+        footer = f"{'...' if piece.truncated else ''}\n--- End {piece.label} ---\n\n"
+        parts.extend((header, piece.text, footer))
+        if spans is not None:
+            start = offset + len(header)
+            spans.append(ContextSpan(piece.label, start, start + len(piece.text), piece.tokens, piece.truncated, piece.doc_id))
+        offset += len(header) + len(piece.text) + len(footer)
+    parts.append("---\n")
+    return "".join(parts)
+
+
+def render_history(turns):
+    """Renders packed chat turns as the conversation section of the context."""
+    if not turns:
+        return ""
+    return "Conversation so far:\n" + "".join(f"{turn.label}: {turn.text}\n\n" for turn in turns)
+
+
+def build_document_context(pieces, budget):
+    """Packs document pieces into budget by fair share and renders them."""
+    packed, dropped = context_packer.pack_fair_share(pieces, budget)
+    spans = []
+    text = render_documents(packed, spans)
+    return DocumentContext(
+        text=text,
+        tokens=sum(piece.tokens + context_packer.PIECE_OVERHEAD_TOKENS for piece in packed),
+        budget=budget,
+        pieces=tuple(spans),
+        dropped=tuple(dropped),
+    )
+
+
+def document_context(documents, budget):
+    """Returns the memoized DocumentContext for (filename, doc_id) pairs of stored documents."""
+    documents = tuple(documents)
+    key = (frozenset(documents), budget)
+    with _memo_lock:
+        handle = _memo.get(key)
+        if handle is not None:
+            _memo.move_to_end(key)
+            _memo_stats["hits"] += 1
+            return handle
+        _memo_stats["misses"] += 1
+    pieces = []
+    for filename, doc_id in documents:
+        text = document_store.get_text(doc_id)
+        if text is not None:
+            pieces.append(context_packer.Piece(filename, text, doc_id=doc_id))
+    fingerprint = hashlib.sha256(repr((sorted(key[0]), budget)).encode("utf-8")).hexdigest()
+    handle = dataclasses.replace(build_document_context(pieces, budget), fingerprint=fingerprint)
+    with _memo_lock:
+        _memo[key] = handle
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return handle
+
+
+def compose(history, document_text, document_tokens, documents=None):
+    """Prepends packed chat history to rendered file context."""
+    history_text = render_history(history)
+    return PromptContext(
+        text=(history_text + document_text).strip(),
+        tokens=document_tokens + sum(turn.tokens + context_packer.PIECE_OVERHEAD_TOKENS for turn in history),
+        history_turns=len(history),
+        documents=documents,
+        history_text=history_text.strip(),
+    )
+
+
+def memo_stats():
+    """Returns hit/miss counters and the number of memoized contexts."""
+    with _memo_lock:
+        return dict(_memo_stats, entries=len(_memo))
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+# --- Context Prefix Cache ---
+# When follow-up questions are asked about the same documents, the document
+# context is registered once as a cached prefix and only the history and the
+# question are sent with each turn. The "gemini" backend uses Gemini's
+# CachedContent API (through llm_backends.GeminiBackend, other LLM backends
+# fall back to "local"); the "local" stand-in keeps the prefix in memory and
+# prepends it to each request, which behaves the same without calling the
+# caching API (useful for tests and models without caching support).
+# Prefixes are shared by all sessions using the same documents and budget, and
+# are deleted when their TTL runs out or no session uses them any more. Sessions
+# count themselves on the CachedPrefix they hold, not on its fingerprint, so a
+# session still holding an expired prefix cannot delete its replacement.
+
+BACKEND = os.environ.get("CONTEXT_CACHE_BACKEND", "gemini")  # "gemini", "local" or "off"
+TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Gemini only caches prompts above a minimum size; smaller contexts are sent as usual
+MIN_CACHE_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "4096"))
+
+CONTEXT_HEADER = "Use the following context if relevant:\n--- CONTEXT START ---\n"
+CONTEXT_FOOTER = "\n--- CONTEXT END ---"
+
+
+@dataclass
+class CachedPrefix:
+    """A document context registered once and reused for later questions."""
+    fingerprint: str
+    backend: str
+    tokens: int  # Estimated tokens of the prefix
+    handle: object = None  # CachedContent (gemini) or the prefix text (local)
+    created_at: float = field(default_factory=time.time)
+    expires_at: float = 0.0
+    uses: int = 0
+    saved_tokens: int = 0  # Prefix tokens not re-sent thanks to the cache
+    sessions: int = 0  # Sessions currently using this prefix
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+
+class _PrefixedModel:
+    """Stand-in for a model created from cached content: prepends the prefix to every request."""
+
+    def __init__(self, model, prefix_text):
+        self._model = model
+        self._prefix_text = prefix_text
+
+    @property
+    def model_name(self):
+        return self._model.model_name
+
+    def generate_content(self, contents, **kwargs):
+        return self._model.generate_content(f"{self._prefix_text}\n\n{contents}", **kwargs)
+
+
+_prefixes = {}  # fingerprint -> CachedPrefix
+_lock = threading.Lock()
+_stats = {"created": 0, "expired": 0, "failed": 0, "uses": 0, "saved_tokens": 0}
+
+
+def _delete(prefix):
+    if prefix.backend == "gemini":
+        try:
+            prefix.handle.delete()
+        except Exception:
+            pass  # Already expired on the server side
+
+
+def _prune():
+    for fingerprint in [f for f, prefix in _prefixes.items() if prefix.expired]:
+        _delete(_prefixes.pop(fingerprint))
+        _stats["expired"] += 1
+
+
+def get_prefix(model, documents):
+    """Returns the CachedPrefix for a memoized DocumentContext, registering it on first use.
+
+    Returns None if caching is off, the context is too small or not stable (no fingerprint),
+    or the prefix could not be registered; the caller then sends the context as usual.
+    """
+    if BACKEND == "off" or not documents.fingerprint or documents.tokens < MIN_CACHE_TOKENS:
+        return None
+    with _lock:
+        _prune()
+        prefix = _prefixes.get(documents.fingerprint)
+        if prefix is not None:
+            return prefix
+    text = f"{CONTEXT_HEADER}{documents.text}{CONTEXT_FOOTER}"
+    backend, handle = "local", text
+    if BACKEND == "gemini" and getattr(model, "supports_context_cache", False):
+        try:
+            backend, handle = "gemini", model.create_cached_content([text], TTL_SECONDS, "legal-chatbot-document-context")
+        except Exception:
+            # Model without caching support, quota, network: fall back to sending the prefix
+            with _lock:
+                _stats["failed"] += 1
+    prefix = CachedPrefix(documents.fingerprint, backend, documents.tokens, handle, expires_at=time.time() + TTL_SECONDS)
+    with _lock:
+        existing = _prefixes.get(documents.fingerprint)
+        if existing is not None:  # Another session registered it meanwhile
+            _delete(prefix)
+            return existing
+        _prefixes[documents.fingerprint] = prefix
+        _stats["created"] += 1
+    return prefix
+
+
+def model_for(prefix, model):
+    """Returns a model whose requests start with the cached prefix."""
+    if prefix.backend == "gemini":
+        return model.from_cached_content(prefix.handle)
+    return _PrefixedModel(model, prefix.handle)
+
+
+def record_use(prefix, cached_tokens=None):
+    """Counts a request that reused prefix and returns the tokens it saved.
+
+    cached_tokens is the count reported by the API, if any. The local stand-in re-sends the
+    prefix, so it saves nothing.
+    """
+    saved = 0
+    if prefix.backend == "gemini":
+        saved = cached_tokens if cached_tokens is not None else prefix.tokens
+    with _lock:
+        prefix.uses += 1
+        prefix.saved_tokens += saved
+        _stats["uses"] += 1
+        _stats["saved_tokens"] += saved
+    return saved
+
+
+def acquire(prefix):
+    """Marks a prefix returned by get_prefix as used by one more session.
+
+    Returns False if it was deleted in the meantime; the caller then sends the context as usual.
+    """
+    with _lock:
+        if _prefixes.get(prefix.fingerprint) is not prefix:
+            return False
+        prefix.sessions += 1
+        return True
+
+
+def release(prefix):
+    """Marks a prefix as no longer used by a session, e.g. after its documents changed.
+
+    The prefix is deleted once no session uses it. A prefix that expired has already been
+    deleted, and a newer prefix registered for the same documents is left alone.
+    """
+    with _lock:
+        prefix.sessions -= 1
+        if prefix.sessions <= 0 and _prefixes.get(prefix.fingerprint) is prefix:
+            _delete(_prefixes.pop(prefix.fingerprint))
+            _stats["expired"] += 1
+
+
+def cache_stats():
+    """Returns counters of registered prefixes, reuses and saved tokens since startup."""
+    with _lock:
+        _prune()
+        return dict(
+            _stats,
+            backend=BACKEND,
+            active=len(_prefixes),
+        )
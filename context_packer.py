@@ -0,0 +1,180 @@
+import collections
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+
+# --- Context Packing ---
+# Fits document text and chat history into a token budget before a prompt is
+# sent to Gemini. Tokens are estimated locally (no API round trip), and the
+# estimate is cached per text since the same documents are packed every turn.
+
+# Gemini 2.5 Pro input window
+MODEL_CONTEXT_TOKENS = int(os.environ.get("MODEL_CONTEXT_TOKENS", "1000000"))
+# Default budgets for the file/history context of each tab, in tokens
+DEFAULT_BUDGETS = {
+    "General Chat": int(os.environ.get("CHAT_CONTEXT_TOKENS", "200000")),
+}
+# Share of the budget chat history may use. Retrieved passages get whatever it leaves
+# unused; full documents always leave it reserved so their packed context can be memoized
+HISTORY_SHARE = float(os.environ.get("CONTEXT_HISTORY_SHARE", "0.2"))
+# Tokens of the headers wrapped around every piece ("--- Start file ---" etc.)
+PIECE_OVERHEAD_TOKENS = 12
+# US dollars per million tokens, used for the cost estimate shown per turn
+INPUT_PRICE_PER_M = float(os.environ.get("GEMINI_INPUT_PRICE_PER_M", "1.25"))
+OUTPUT_PRICE_PER_M = float(os.environ.get("GEMINI_OUTPUT_PRICE_PER_M", "10.0"))
+CACHED_INPUT_PRICE_PER_M = float(os.environ.get("GEMINI_CACHED_INPUT_PRICE_PER_M", "0.31"))
+
+_WORD_RE = re.compile(r"\S+")
+_estimate_cache = collections.OrderedDict()  # (length, hash) of text -> estimate
+_estimate_cache_lock = threading.Lock()
+ESTIMATE_CACHE_SIZE = 4096
+
+
+def estimate_tokens(text):
+    """Estimates the number of Gemini tokens in text.
+
+    Uses the larger of ~4 characters per token and ~0.75 words per token, which stays
+    close for English prose and does not undercount text with many short words or numbers.
+    Estimates are cached by the text's length and hash (strings cache their hash), so
+    repeated estimates of the same document are O(1) and the cache keeps no text alive.
+    """
+    if not text:
+        return 0
+    key = (len(text), hash(text))
+    with _estimate_cache_lock:
+        tokens = _estimate_cache.get(key)
+        if tokens is not None:
+            _estimate_cache.move_to_end(key)
+            return tokens
+    words = sum(1 for _ in _WORD_RE.finditer(text))
+    tokens = max((len(text) + 3) // 4, (words * 4 + 2) // 3)
+    with _estimate_cache_lock:
+        _estimate_cache[key] = tokens
+        if len(_estimate_cache) > ESTIMATE_CACHE_SIZE:
+            _estimate_cache.popitem(last=False)
+    return tokens
+
+
+def estimate_cost(input_tokens, output_tokens=0, cached_tokens=0):
+    """Estimated request cost in US dollars; cached_tokens of the input are billed at the cached rate."""
+    return (
+        (input_tokens - cached_tokens) * INPUT_PRICE_PER_M
+        + cached_tokens * CACHED_INPUT_PRICE_PER_M
+        + output_tokens * OUTPUT_PRICE_PER_M
+    ) / 1_000_000
+
+
+@dataclass
+class Piece:
+    """A candidate piece of context: a document, a passage or a chat turn."""
+    label: str
+    text: str
+    priority: float = 0.0  # Higher priority pieces are packed first (e.g. retrieval score)
+    tokens: int = None
+    truncated: bool = False
+    doc_id: str = None  # Stored document the text comes from, if any
+
+    def __post_init__(self):
+        if self.tokens is None:
+            self.tokens = estimate_tokens(self.text)
+
+
+@dataclass
+class PackedContext:
+    """Pieces selected to fit a budget."""
+    pieces: list = field(default_factory=list)
+    history: list = field(default_factory=list)  # Chat turns, oldest first
+    dropped: list = field(default_factory=list)  # Labels of pieces left out entirely
+    budget: int = 0
+
+    @property
+    def tokens(self):
+        return sum(piece.tokens + PIECE_OVERHEAD_TOKENS for piece in self.pieces + self.history)
+
+
+def _truncate(piece, tokens):
+    """Returns a copy of piece cut to about the given number of tokens."""
+    chars = max(int(len(piece.text) * tokens / piece.tokens), 0)
+    return Piece(piece.label, piece.text[:chars], piece.priority, tokens=min(tokens, piece.tokens), truncated=True, doc_id=piece.doc_id)
+
+
+def pack_by_priority(pieces, budget):
+    """Selects whole pieces in priority order, skipping any that no longer fit.
+
+    Used for retrieved passages, which are small and ranked by relevance.
+    """
+    packed, dropped = [], []
+    remaining = budget
+    for piece in sorted(pieces, key=lambda piece: piece.priority, reverse=True):
+        cost = piece.tokens + PIECE_OVERHEAD_TOKENS
+        if cost <= remaining:
+            packed.append(piece)
+            remaining -= cost
+        else:
+            dropped.append(piece.label)
+    return packed, dropped
+
+
+def pack_fair_share(pieces, budget):
+    """Fits every piece by giving each an equal share of the budget, truncating only the largest.
+
+    Pieces smaller than their share are kept whole and the space they leave is shared among the
+    rest, so one large file cannot crowd out the others regardless of upload order.
+    Pieces keep their original order.
+    """
+    allowances = {}
+    remaining = budget
+    by_size = sorted(range(len(pieces)), key=lambda i: pieces[i].tokens)
+    for position, i in enumerate(by_size):
+        share = remaining // (len(pieces) - position)
+        allowances[i] = min(pieces[i].tokens, max(share - PIECE_OVERHEAD_TOKENS, 0))
+        remaining -= allowances[i] + PIECE_OVERHEAD_TOKENS
+    packed, dropped = [], []
+    for i, piece in enumerate(pieces):
+        if allowances[i] <= 0:
+            dropped.append(piece.label)
+        elif allowances[i] < piece.tokens:
+            packed.append(_truncate(piece, allowances[i]))
+        else:
+            packed.append(piece)
+    return packed, dropped
+
+
+def pack_history(turns, budget, summary=None):
+    """Keeps the most recent chat turns that fit the budget, returned oldest first.
+
+    A summary piece of older turns (see chat_memory.py) is packed first and returned ahead of
+    the turns; it is cut to the budget if needed.
+    """
+    kept = []
+    remaining = budget
+    if summary is not None and summary.text and remaining > PIECE_OVERHEAD_TOKENS:
+        if summary.tokens + PIECE_OVERHEAD_TOKENS > remaining:
+            summary = _truncate(summary, remaining - PIECE_OVERHEAD_TOKENS)
+        remaining -= summary.tokens + PIECE_OVERHEAD_TOKENS
+    else:
+        summary = None
+    for turn in reversed(turns):
+        cost = turn.tokens + PIECE_OVERHEAD_TOKENS
+        if cost > remaining:
+            break
+        kept.append(turn)
+        remaining -= cost
+    return ([summary] if summary is not None else []) + kept[::-1]
+
+
+def pack(documents, history, budget, ranked=False, history_share=HISTORY_SHARE, summary=None):
+    """Packs chat history and document pieces into budget tokens.
+
+    History (and its summary, if any) gets up to history_share of the budget; the rest goes to
+    documents, packed by priority if ranked (retrieved passages) or by fair share (full documents).
+    """
+    budget = min(budget, MODEL_CONTEXT_TOKENS)
+    history = pack_history(history, int(budget * history_share), summary)
+    remaining = budget - sum(turn.tokens + PIECE_OVERHEAD_TOKENS for turn in history)
+    if ranked:
+        pieces, dropped = pack_by_priority(documents, remaining)
+    else:
+        pieces, dropped = pack_fair_share(documents, remaining)
+    return PackedContext(pieces=pieces, history=history, dropped=dropped, budget=budget)
@@ -0,0 +1,115 @@
+import functools
+import os
+import re
+
+import streamlit as st
+
+import document_store
+from pdf_extraction import page_for_offset
+
+# --- Context Viewer ---
+# Paged viewer for the file context sent to the AI. Only the visible page of
+# one file is sent to the browser, plus a bounded list of search matches, so
+# rendering cost does not depend on how much text is loaded. Pages follow the
+# PDF pages of a document where known, otherwise fixed-size windows.
+
+PAGE_CHARS = int(os.environ.get("CONTEXT_VIEWER_PAGE_CHARS", "5000"))
+MAX_MATCHES = 50
+SNIPPET_CHARS = 60
+
+
+@functools.lru_cache(maxsize=256)
+def _stored_page_offsets(doc_id):
+    return tuple(document_store.get_page_offsets(doc_id))  # Page offsets never change for a document id
+
+
+def page_bounds(span):
+    """Returns (start, end) offsets into the context text of each viewer page of a span.
+
+    Pages follow the document's own pages when it has them; pages longer than
+    PAGE_CHARS, and documents without pages, are split into PAGE_CHARS windows.
+    """
+    length = span.end - span.start
+    starts = [offset for offset in (_stored_page_offsets(span.doc_id) if span.doc_id else ()) if offset < length] or [0]
+    bounds = []
+    for page_start, page_end in zip(starts, starts[1:] + [length]):
+        for window_start in range(page_start, max(page_end, page_start + 1), PAGE_CHARS):
+            bounds.append((span.start + window_start, span.start + min(window_start + PAGE_CHARS, page_end)))
+    return bounds
+
+
+def find_matches(text, query, spans, limit=MAX_MATCHES):
+    """Returns up to limit (span index, match offset) pairs of case-insensitive matches of query.
+
+    Searches the context text in place, without copying the documents.
+    """
+    pattern = re.compile(re.escape(query), re.IGNORECASE)
+    matches = []
+    for span_index, span in enumerate(spans):
+        for match in pattern.finditer(text, span.start, span.end):
+            matches.append((span_index, match.start()))
+            if len(matches) >= limit:
+                return matches
+    return matches
+
+
+def _snippet(text, span, offset, query_length):
+    start = max(span.start, offset - SNIPPET_CHARS)
+    end = min(span.end, offset + query_length + SNIPPET_CHARS)
+    before, match, after = text[start:offset], text[offset:offset + query_length], text[offset + query_length:end]
+    return " ".join(f"…{before}[{match}]{after}…".split())
+
+
+def render_context_viewer(context, key):
+    """Shows a DocumentContext (see context_builder.py) one page at a time, with search."""
+    if not context.pieces:
+        st.caption("No file text in the context.")
+        return
+    labels = [span.label for span in context.pieces]
+    file_key, page_key = f"{key}_file", f"{key}_page"
+    if st.session_state.get(file_key) not in range(len(labels)):
+        st.session_state[file_key] = 0
+
+    def jump(span_index, page):
+        st.session_state[file_key] = span_index
+        st.session_state[page_key] = page
+
+    query = st.text_input("Search within context", key=f"{key}_search", placeholder="e.g. limitation period")
+    if query:
+        matches = find_matches(context.text, query, context.pieces)
+        if not matches:
+            st.caption("No matches.")
+        else:
+            st.caption(f"{len(matches)}{'+' if len(matches) >= MAX_MATCHES else ''} matches")
+            with st.container(height=200):
+                for number, (span_index, offset) in enumerate(matches):
+                    span = context.pieces[span_index]
+                    bounds = page_bounds(span)
+                    page = next(i for i, (start, end) in enumerate(bounds) if offset < end or i == len(bounds) - 1) + 1
+                    st.button(
+                        f"{span.label}, p. {page}: {_snippet(context.text, span, offset, len(query))}",
+                        key=f"{key}_match_{number}",
+                        on_click=jump,
+                        args=(span_index, page),
+                    )
+
+    col1, col2 = st.columns([0.7, 0.3])
+    with col1:
+        span_index = st.selectbox(
+            "File", range(len(labels)), format_func=lambda i: labels[i], key=file_key,
+            on_change=lambda: st.session_state.pop(page_key, None),
+        )
+    span = context.pieces[span_index]
+    bounds = page_bounds(span)
+    with col2:
+        if not 1 <= st.session_state.get(page_key, 0) <= len(bounds):
+            st.session_state[page_key] = 1
+        page = st.number_input("Page", min_value=1, max_value=len(bounds), key=page_key)
+    start, end = bounds[page - 1]
+    pages = _stored_page_offsets(span.doc_id) if span.doc_id else ()
+    location = f"PDF page {page_for_offset(pages, start - span.start) + 1} · " if pages else ""
+    st.caption(
+        f"Page {page} of {len(bounds)} · {location}characters {start - span.start:,}–{end - span.start:,} of {span.end - span.start:,} · "
+        f"~{span.tokens:,} tokens{' (truncated to fit the budget)' if span.truncated else ''}"
+    )
+    st.text_area("Context page", value=context.text[start:end], height=300, disabled=True, label_visibility="collapsed")
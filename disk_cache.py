@@ -0,0 +1,136 @@
+import os
+import threading
+import tempfile
+
+# --- Disk Cache ---
+# Size-bounded key/value store of text values kept as files on disk. Entries are
+# evicted least-recently-used first (recency is tracked with the file mtime), so
+# the cache is shared by every session of the app and by every process using the
+# same directory.
+
+class DiskCache:
+    """A size-bounded, least-recently-used text cache persisted in a directory."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None  # Lazily computed total size of the entries on disk
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def get(self, key, is_valid=None):
+        """Return the cached value for key, or None if it is not cached.
+
+        If is_valid(value) is false (e.g. the entry expired), the entry is removed and counted as a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+        except (OSError, UnicodeDecodeError):
+            value = None
+        if value is not None and is_valid is not None and not is_valid(value):
+            self.delete(key)
+            value = None
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store value under key and evict old entries if the cache is over its size limit."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            data = value.encode("utf-8")
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                old_size = os.path.getsize(self._path(key))  # Overwriting an entry, e.g. a forced refresh
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data) - old_size
+            self._evict_if_needed()
+
+    def delete(self, key):
+        """Remove the entry for key, if any."""
+        try:
+            size = os.path.getsize(self._path(key))
+            os.remove(self._path(key))
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _scan(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(".txt"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+        return entries
+
+    def _evict_if_needed(self):
+        if self._size is not None and self._size <= self.max_bytes:
+            return
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+                if total <= self.max_bytes:
+                    break
+        self._size = total
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            for _, _, path in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
@@ -1,7 +1,9 @@
 import streamlit as st
 import difflib
 import re
-from io import BytesIO
+import document_store
+import extractors
+from upload_spool import SpooledUpload, MemoryProbe
 
 # --- Document Comparison Tool ---
 # This tool allows users to compare two legal documents and see the differences
@@ -9,38 +11,15 @@ from io import BytesIO
 def extract_text_from_uploaded_file(uploaded_file):
     """Extract text from an uploaded file based on its type."""
     try:
-        file_content = uploaded_file.getvalue()
-        file_type = uploaded_file.type
-        
-        # Text files
-        if file_type == "text/plain":
-            return file_content.decode('utf-8', errors='replace')
-            
-        # PDF files
-        elif file_type == "application/pdf":
-            try:
-                import PyPDF2
-                pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-                text = ""
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text: 
-                        text += page_text + "\n"
-                return text if text else "Could not extract text from PDF."
-            except ImportError:
-                return "PDF extraction requires PyPDF2 library."
-                
-        # DOCX files
-        elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            try:
-                import docx
-                document = docx.Document(BytesIO(file_content))
-                text = "\n".join([para.text for para in document.paragraphs])
-                return text
-            except ImportError:
-                return "DOCX extraction requires python-docx library."
-        else:
-            return f"Unsupported file type: {file_type}"
+        # Same extractors and cache as the Upload Files tab (see extractors.py)
+        with SpooledUpload(uploaded_file) as spooled, MemoryProbe(spooled.name, spooled.size):
+            result = extractors.extract(spooled, uploaded_file.type)
+        # Stored so the document can later be loaded as context without uploading it again
+        document_store.put_document(result.sha256, spooled.name, uploaded_file.type, spooled.size, result.text, result.page_offsets,
+                                    owner=st.session_state.get("user_id"))
+        return result.text
+    except extractors.ExtractionError as e:
+        return f"Error extracting text: {e}"
     except Exception as e:
         return f"Error extracting text: {str(e)}"
 
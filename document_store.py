@@ -0,0 +1,233 @@
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# --- Document Store ---
+# Extracted documents are stored once in SQLite, compressed and keyed by the
+# SHA-256 of the uploaded file, so sessions only keep document ids, the same
+# file loaded by several users is stored once, and documents survive restarts.
+# Recently read texts are kept decompressed in a small in-process cache shared
+# by all sessions. Each document records the users (owners) who added it, and
+# a user only sees their own documents; once the compressed texts exceed
+# STORE_MAX_BYTES the least recently used documents are removed.
+
+STORE_PATH = os.environ.get("DOCUMENT_STORE_PATH", os.path.join(".cache", "documents.sqlite3"))
+# Decompressed texts kept in memory, shared by all sessions
+TEXT_CACHE_MAX_CHARS = int(os.environ.get("DOCUMENT_TEXT_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Compressed texts kept on disk; least recently used documents beyond this are removed
+STORE_MAX_BYTES = int(os.environ.get("DOCUMENT_STORE_MAX_MB", "1024")) * 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()  # Store paths whose schema has been created
+
+_text_cache = collections.OrderedDict()  # doc id -> text, least recently used first
+_text_cache_chars = 0
+_text_cache_lock = threading.Lock()
+
+
+def _connect():
+    """Returns this thread's connection to the store, creating the schema on first use."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    connection = connections.get(STORE_PATH)
+    if connection is None:
+        directory = os.path.dirname(STORE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(STORE_PATH, timeout=30)
+        connection.row_factory = sqlite3.Row
+        with _schema_lock:
+            if STORE_PATH not in _schema_ready:
+                connection.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+                connection.execute("""
+                    CREATE TABLE IF NOT EXISTS documents (
+                        id TEXT PRIMARY KEY,
+                        filename TEXT NOT NULL,
+                        mime_type TEXT,
+                        size INTEGER,
+                        pages INTEGER,
+                        chars INTEGER,
+                        page_offsets TEXT,
+                        text BLOB NOT NULL,
+                        uploaded_at REAL,
+                        last_used_at REAL
+                    )
+                """)
+                connection.execute("CREATE INDEX IF NOT EXISTS documents_last_used ON documents (last_used_at)")
+                connection.execute("""
+                    CREATE TABLE IF NOT EXISTS document_owners (
+                        doc_id TEXT NOT NULL,
+                        owner TEXT NOT NULL,
+                        added_at REAL,
+                        PRIMARY KEY (owner, doc_id)
+                    )
+                """)
+                connection.execute("CREATE INDEX IF NOT EXISTS document_owners_doc ON document_owners (doc_id)")
+                connection.commit()
+                _schema_ready.add(STORE_PATH)
+        connections[STORE_PATH] = connection
+    return connection
+
+
+def put_document(doc_id, filename, mime_type, size, text, page_offsets=None, owner=None):
+    """Stores an extracted document under its content hash and returns doc_id.
+
+    If the document is already stored, only its last-used time is updated. With an
+    owner, the document is also added to that user's documents (see add_owner).
+    """
+    connection = _connect()
+    now = time.time()
+    with connection:
+        cursor = connection.execute("UPDATE documents SET last_used_at = ? WHERE id = ?", (now, doc_id))
+        if cursor.rowcount == 0:
+            connection.execute(
+                "INSERT OR IGNORE INTO documents (id, filename, mime_type, size, pages, chars, page_offsets, text, uploaded_at, last_used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    doc_id, filename, mime_type, size,
+                    len(page_offsets) if page_offsets else None,
+                    len(text),
+                    json.dumps(page_offsets) if page_offsets else None,
+                    zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL),
+                    now, now,
+                ),
+            )
+        if owner:
+            _add_owner(connection, doc_id, owner, now)
+        _evict_if_needed(connection, keep=doc_id)
+    _cache_text(doc_id, text)  # Sessions usually read a document right after adding it
+    return doc_id
+
+
+def _add_owner(connection, doc_id, owner, now):
+    connection.execute(
+        "INSERT OR REPLACE INTO document_owners (doc_id, owner, added_at) VALUES (?, ?, ?)", (doc_id, owner, now)
+    )
+
+
+def _evict_if_needed(connection, keep):
+    """Removes least recently used documents (except keep) while the texts exceed STORE_MAX_BYTES."""
+    total = connection.execute("SELECT COALESCE(SUM(LENGTH(text)), 0) FROM documents").fetchone()[0]
+    if total <= STORE_MAX_BYTES:
+        return
+    evicted = []
+    for row in connection.execute(
+        "SELECT id, LENGTH(text) AS bytes FROM documents WHERE id != ? ORDER BY last_used_at", (keep,)
+    ).fetchall():
+        if total <= STORE_MAX_BYTES:
+            break
+        evicted.append(row["id"])
+        total -= row["bytes"]
+    connection.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in evicted])
+    connection.executemany("DELETE FROM document_owners WHERE doc_id = ?", [(doc_id,) for doc_id in evicted])
+    _uncache_texts(evicted)
+
+
+def _uncache_texts(doc_ids):
+    global _text_cache_chars
+    with _text_cache_lock:
+        for doc_id in doc_ids:
+            text = _text_cache.pop(doc_id, None)
+            if text is not None:
+                _text_cache_chars -= len(text)
+
+
+def _cache_text(doc_id, text):
+    global _text_cache_chars
+    with _text_cache_lock:
+        if doc_id in _text_cache:
+            _text_cache.move_to_end(doc_id)
+            return
+        _text_cache[doc_id] = text
+        _text_cache_chars += len(text)
+        while _text_cache_chars > TEXT_CACHE_MAX_CHARS and len(_text_cache) > 1:
+            _, evicted = _text_cache.popitem(last=False)
+            _text_cache_chars -= len(evicted)
+
+
+def get_text(doc_id):
+    """Returns the text of a stored document, or None if it is not in the store."""
+    with _text_cache_lock:
+        text = _text_cache.get(doc_id)
+        if text is not None:
+            _text_cache.move_to_end(doc_id)
+            return text
+    row = _connect().execute("SELECT text FROM documents WHERE id = ?", (doc_id,)).fetchone()
+    if row is None:
+        return None
+    text = zlib.decompress(row["text"]).decode("utf-8")
+    _cache_text(doc_id, text)
+    return text
+
+
+def _metadata(row):
+    return {
+        "id": row["id"],
+        "filename": row["filename"],
+        "mime_type": row["mime_type"],
+        "size": row["size"],
+        "pages": row["pages"],
+        "chars": row["chars"],
+        "uploaded_at": row["uploaded_at"],
+        "last_used_at": row["last_used_at"],
+    }
+
+
+def get_metadata(doc_id):
+    """Returns metadata (filename, size, pages, chars, upload time) of a stored document, or None."""
+    row = _connect().execute(
+        "SELECT id, filename, mime_type, size, pages, chars, uploaded_at, last_used_at FROM documents WHERE id = ?",
+        (doc_id,),
+    ).fetchone()
+    return _metadata(row) if row is not None else None
+
+
+def get_page_offsets(doc_id):
+    """Returns the start offset of every page of a stored document (empty if not paged)."""
+    row = _connect().execute("SELECT page_offsets FROM documents WHERE id = ?", (doc_id,)).fetchone()
+    if row is None or not row["page_offsets"]:
+        return []
+    return json.loads(row["page_offsets"])
+
+
+def list_documents(owner, limit=50):
+    """Returns metadata of the owner's most recently used documents."""
+    rows = _connect().execute(
+        "SELECT id, filename, mime_type, size, pages, chars, uploaded_at, last_used_at FROM documents"
+        " JOIN document_owners ON document_owners.doc_id = documents.id"
+        " WHERE document_owners.owner = ? ORDER BY last_used_at DESC LIMIT ?",
+        (owner, limit),
+    ).fetchall()
+    return [_metadata(row) for row in rows]
+
+
+def add_owner(doc_id, owner):
+    """Adds a stored document to the documents of owner, a user id."""
+    with _connect() as connection:
+        _add_owner(connection, doc_id, owner, time.time())
+
+
+def touch(doc_id):
+    """Marks a document as used now, e.g. when a session loads it from the store."""
+    with _connect() as connection:
+        connection.execute("UPDATE documents SET last_used_at = ? WHERE id = ?", (time.time(), doc_id))
+
+
+def store_stats():
+    """Returns the number of stored documents, their total characters and the store size on disk."""
+    row = _connect().execute("SELECT COUNT(*) AS documents, COALESCE(SUM(chars), 0) AS chars FROM documents").fetchone()
+    try:
+        disk_bytes = os.path.getsize(STORE_PATH)
+    except OSError:
+        disk_bytes = 0
+    with _text_cache_lock:
+        cached_chars = _text_cache_chars
+    return {"documents": row["documents"], "chars": row["chars"], "disk_bytes": disk_bytes, "cached_chars": cached_chars,
+            "max_bytes": STORE_MAX_BYTES}
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+
+from disk_cache import DiskCache
+
+# --- Extraction Cache ---
+# Caches text extracted from uploaded documents, keyed by a SHA-256 of the file
+# bytes plus the extractor name and version. The cache lives on disk, so every
+# tab, session and restart reuses the work of parsing the same file.
+
+# Bump when extraction output changes so stale entries are no longer used
+EXTRACTOR_VERSION = "3"
+
+CACHE_DIR = os.environ.get("EXTRACTION_CACHE_DIR", os.path.join(".cache", "extracted_text"))
+CACHE_MAX_BYTES = int(os.environ.get("EXTRACTION_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+_cache = DiskCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+
+def content_hash(file_content):
+    """Returns the SHA-256 hex digest of the file bytes."""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def cache_key(file_content, extractor_name, digest=None):
+    """Builds the cache key for a file and the extractor used to parse it.
+
+    Pass digest (the SHA-256 hex digest of the file) when it is already known to avoid hashing again.
+    """
+    key = hashlib.sha256(f"{extractor_name}:{EXTRACTOR_VERSION}:".encode("utf-8"))
+    key.update((digest or content_hash(file_content)).encode("ascii"))
+    return key.hexdigest()
+
+
+def is_cacheable(text):
+    """Only successful extractions are cached; error messages are retried next time."""
+    return isinstance(text, str) and bool(text) and not text.startswith(("Error", "Could not"))
+
+
+def get_record(key):
+    """Returns the cached extraction record for key, or None on a miss."""
+    cached = _cache.get(key)
+    if cached is None:
+        return None
+    try:
+        return json.loads(cached)
+    except ValueError:
+        return None  # Corrupt entry; it is overwritten by the next extraction
+
+
+def put_record(key, record):
+    """Stores an extraction record (a dict with "text" and optional metadata) if it is cacheable."""
+    if is_cacheable(record.get("text")):
+        _cache.set(key, json.dumps(record))
+
+
+def cache_stats():
+    """Returns hit/miss counters and size of the shared extraction cache."""
+    return _cache.stats()
+
+
+def clear_cache():
+    """Removes all cached extractions."""
+    _cache.clear()
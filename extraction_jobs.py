@@ -0,0 +1,176 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import document_store
+import extractors
+import retrieval
+from upload_spool import MemoryProbe
+
+# --- Background Extraction Jobs ---
+# Extraction runs on a worker pool shared by every session, outside of the
+# Streamlit script thread, so it keeps going across reruns and tab switches.
+# Sessions submit spooled uploads, keep the returned job ids and poll the job
+# table; results are picked up whenever the session next reruns. Finished
+# documents are saved to the document store and indexed for passage retrieval,
+# and sessions keep only their ids. Bulk jobs (archive members) parse their file
+# in the process pool, so these threads only wait and store the results.
+
+JOB_WORKERS = int(os.environ.get("EXTRACTION_JOB_WORKERS", "4"))
+# Finished jobs whose results were never collected are dropped after this many seconds
+JOB_RETENTION_SECONDS = int(os.environ.get("EXTRACTION_JOB_RETENTION_SECONDS", "3600"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+@dataclass
+class Job:
+    """An extraction job and its progress."""
+    id: int
+    name: str
+    file_type: str
+    size: int
+    status: str = QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+    state: dict = None  # Extraction state; its chunks are usable while the job runs
+    result: object = None  # extractors.ExtractionResult once done
+    doc_id: str = None  # Id of the extracted document in document_store once done
+    error: str = None
+    cancel_requested: bool = False
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def elapsed(self):
+        """Seconds the job has been running (or ran), or waited so far if still queued."""
+        if self.started_at is None:
+            return time.time() - self.submitted_at
+        return (self.finished_at or time.time()) - self.started_at
+
+    def progress(self):
+        """Fraction of the document extracted so far."""
+        if self.status == DONE:
+            return 1.0
+        if not self.state or not self.state["total"]:
+            return 0.0
+        return self.state["done"] / self.state["total"]
+
+    def partial_text(self):
+        """Text extracted so far."""
+        if self.result is not None:
+            return self.result.text
+        return "".join(list(self.state["chunks"])) if self.state else ""
+
+
+_executor = None
+_jobs = {}  # job id -> Job
+_jobs_lock = threading.Lock()
+_job_ids = itertools.count(1)
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _get_executor():
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="extraction")
+        return _executor
+
+
+def _run(job, content, on_done, bulk):
+    def check_cancelled(state):
+        if job.cancel_requested:
+            raise _Cancelled()
+
+    try:
+        if job.cancel_requested:
+            job.status = CANCELLED
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        with MemoryProbe(job.name, job.size):
+            job.result = extractors.extract(content, job.file_type, state=job.state, on_progress=check_cancelled, bulk=bulk)
+        job.doc_id = document_store.put_document(
+            job.result.sha256, job.name, job.file_type, job.size, job.result.text, job.result.page_offsets,
+        )
+        retrieval.index_document(job.doc_id, job.result.text, job.result.page_offsets)
+        job.state["chunks"] = []  # The joined text is in the result and the store
+        job.status = DONE
+    except extractors.ExtractionError as e:
+        job.error = str(e)
+        job.status = CANCELLED if job.cancel_requested else FAILED
+    except Exception as e:
+        job.error = f"Error extracting text: {e}"
+        job.status = FAILED
+    finally:
+        job.finished_at = time.time()
+        if hasattr(content, "close"):
+            content.close()
+        if on_done is not None:
+            on_done(job)
+
+
+def submit(content, file_type, name=None, on_done=None, bulk=False):
+    """Queues extraction of bytes or a SpooledUpload and returns the job id.
+
+    The job closes a SpooledUpload when done, then calls on_done(job) from the worker thread.
+    bulk is passed on to extractors.extract, e.g. for the members of an archive.
+    """
+    _prune()
+    job = Job(
+        id=next(_job_ids),
+        name=name or getattr(content, "name", "document"),
+        file_type=file_type,
+        size=len(content),
+        state=extractors.new_extraction_state(file_type),
+    )
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _get_executor().submit(_run, job, content, on_done, bulk)
+    return job.id
+
+
+def get_job(job_id):
+    """Returns the job with this id, or None if it is unknown or was forgotten."""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def cancel(job_id):
+    """Asks a queued or running job to stop; it is marked cancelled at its next page/paragraph."""
+    job = get_job(job_id)
+    if job is not None and not job.finished:
+        job.cancel_requested = True
+
+
+def forget(job_id):
+    """Removes a finished job from the table once its result has been collected."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None and job.finished:
+            del _jobs[job_id]
+
+
+def _prune():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _jobs_lock:
+        for job_id in [j.id for j in _jobs.values() if j.finished and (j.finished_at or cutoff) < cutoff]:
+            del _jobs[job_id]
+
+
+def job_counts():
+    """Returns the number of jobs per status across all sessions."""
+    counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+    with _jobs_lock:
+        for job in _jobs.values():
+            counts[job.status] += 1
+    return counts
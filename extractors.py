@@ -0,0 +1,334 @@
+import importlib.util
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+from extraction_cache import cache_key, content_hash, get_record, put_record
+from upload_spool import SpooledUpload, open_binary, content_buffer
+
+# --- Document Extractors ---
+# Single text extraction subsystem shared by every tab. Backends are registered
+# per MIME type and their libraries are only imported the first time a file of
+# that type is extracted. Extraction is a generator pipeline: a backend yields
+# (chunk, units_done, units_total) as pages/paragraphs are parsed, and chunks are
+# collected in a list that is joined once. Finished extractions are cached on
+# disk by content hash (see extraction_cache.py). Content is either bytes or a
+# SpooledUpload (see upload_spool.py), which backends read without copying.
+# In bulk extraction (e.g. a ZIP archive) whole files are parsed in the shared
+# process pool of pdf_extraction.py, so many small PDFs and DOCX files are not
+# parsed one at a time under the GIL of the server process.
+
+PDF_TYPE = "application/pdf"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+TXT_TYPE = "text/plain"
+
+DOCX_PARAGRAPHS_PER_CHUNK = 200
+# In bulk extraction, paged files larger than this are split into page ranges instead of parsed whole
+WHOLE_FILE_MAX_BYTES = int(os.environ.get("EXTRACTION_WHOLE_FILE_MAX_MB", "8")) * 1024 * 1024
+
+
+class ExtractionError(Exception):
+    """Raised when a document cannot be extracted."""
+
+
+@dataclass
+class ExtractorBackend:
+    """A registered extraction backend for one or more MIME types."""
+    name: str
+    loader: object  # Callable returning the chunk generator; imports the backend library
+    requires: tuple = ()  # Modules that must be importable for the backend to be usable
+    priority: int = 0  # Higher priority backends are preferred
+    paged: bool = False  # Whether each chunk is one page (page offsets are recorded)
+    cacheable: bool = True  # Cheap extractions (plain text) are not worth hashing and caching
+    version: str = "1"  # Bump when the backend's output changes
+    error_label: str = "Error extracting text"
+    empty_text: str = ""  # Text returned when nothing could be extracted
+    _iter_chunks: object = field(default=None, repr=False)
+
+    def is_available(self):
+        """Checks that the backend's libraries are installed, without importing them."""
+        return all(importlib.util.find_spec(module) is not None for module in self.requires)
+
+    def iter_chunks(self, file_content, start=0):
+        if self._iter_chunks is None:
+            self._iter_chunks = self.loader()
+        return self._iter_chunks(file_content, start)
+
+
+@dataclass
+class ExtractionResult:
+    """Text extracted from a document, with page offsets, warnings and timings."""
+    text: str
+    page_offsets: list = field(default_factory=list)  # Start offset of each page in text (paged backends)
+    warnings: list = field(default_factory=list)
+    timings: dict = field(default_factory=dict)  # Seconds spent per stage: "hash", "extract", "total"
+    backend: str = ""
+    cached: bool = False
+    sha256: str = ""  # SHA-256 of the file bytes; identifies the document in document_store.py
+
+
+_registry = {}  # MIME type -> list of ExtractorBackend
+_extensions = {}  # MIME type -> file extension, e.g. "pdf"
+_stats = {}  # backend name -> {"files", "bytes", "seconds", "cache_hits"}
+_stats_lock = threading.Lock()
+
+
+def register_extractor(mime_type, backend, extension=None):
+    """Registers a backend for a MIME type, e.g. a faster alternative to the built-in one."""
+    if extension: _extensions[mime_type] = extension
+    backends = _registry.setdefault(mime_type, [])
+    backends[:] = [b for b in backends if b.name != backend.name]
+    backends.append(backend)
+    backends.sort(key=lambda b: b.priority, reverse=True)
+
+
+def get_backend(mime_type):
+    """Returns the preferred available backend for a MIME type, or None.
+
+    The EXTRACTOR_<EXTENSION>_BACKEND environment variable (e.g. EXTRACTOR_PDF_BACKEND=pymupdf)
+    overrides the priority order.
+    """
+    backends = [b for b in _registry.get(mime_type, []) if b.is_available()]
+    preferred = os.environ.get(f"EXTRACTOR_{_extensions.get(mime_type, '').upper()}_BACKEND")
+    for backend in backends:
+        if backend.name == preferred:
+            return backend
+    return backends[0] if backends else None
+
+
+def mime_type_for_extension(extension):
+    """Returns the registered MIME type for a file extension such as "pdf", or None."""
+    extension = extension.lower().lstrip(".")
+    for mime_type, registered in _extensions.items():
+        if registered == extension:
+            return mime_type
+    return None
+
+
+def is_supported(mime_type):
+    """Returns whether files of this MIME type can be extracted in this environment."""
+    return get_backend(mime_type) is not None
+
+
+def missing_backends():
+    """Returns {mime_type: [required modules]} for registered types that have no usable backend."""
+    return {
+        mime_type: sorted({module for b in backends for module in b.requires})
+        for mime_type, backends in _registry.items()
+        if not any(b.is_available() for b in backends)
+    }
+
+
+def new_extraction_state(mime_type):
+    """Creates the resumable state of an in-progress extraction."""
+    return {"file_type": mime_type, "chunks": [], "page_offsets": [], "chars": 0, "done": 0, "total": None}
+
+
+def extract(file_content, mime_type, state=None, on_progress=None, bulk=False):
+    """Extracts a document, using the shared cache when possible.
+
+    Progress is accumulated in state (see new_extraction_state), so an extraction
+    interrupted by a rerun resumes where it stopped, and the chunks extracted so far
+    can be used while extraction continues. on_progress(state) is called after every
+    chunk. With bulk=True the file is parsed whole in the process pool when it is
+    small enough; its chunks then only arrive once it is done. Raises ExtractionError
+    if the document cannot be extracted.
+    """
+    started = time.perf_counter()
+    backend = get_backend(mime_type)
+    if backend is None:
+        if mime_type in _registry:
+            raise ExtractionError(f"library missing for {mime_type}")
+        raise ExtractionError(f"unsupported type: {mime_type}")
+
+    timings = {}
+    key = None
+    digest = file_content.sha256 if isinstance(file_content, SpooledUpload) else content_hash(content_buffer(file_content))
+    timings["hash"] = time.perf_counter() - started
+    if backend.cacheable:
+        key = cache_key(None, f"{backend.name}-{backend.version}", digest)
+        record = get_record(key)
+        if record is not None:
+            timings["total"] = time.perf_counter() - started
+            _record_stats(backend.name, len(file_content), timings["total"], cache_hit=True)
+            return ExtractionResult(
+                text=record["text"],
+                page_offsets=record.get("page_offsets", []),
+                warnings=record.get("warnings", []),
+                timings=timings,
+                backend=backend.name,
+                cached=True,
+                sha256=digest,
+            )
+
+    state = state if state is not None else new_extraction_state(mime_type)
+    extract_started = time.perf_counter()
+    try:
+        chunks = None
+        if bulk and state["done"] == 0 and _parse_whole_in_pool(backend, file_content):
+            chunks = _extract_in_pool(backend, file_content, state, on_progress)
+        if chunks is None:
+            chunks = backend.iter_chunks(file_content, state["done"])
+        for chunk, done, total in chunks:
+            if backend.paged: state["page_offsets"].append(state["chars"])
+            state["chunks"].append(chunk)
+            state["chars"] += len(chunk)
+            state["done"], state["total"] = done, total
+            if on_progress: on_progress(state)
+    except ImportError as e:
+        raise ExtractionError(f"library missing: {e}") from e
+    except Exception as e:
+        raise ExtractionError(f"{backend.error_label}: {e}") from e
+    timings["extract"] = time.perf_counter() - extract_started
+
+    text = "".join(state["chunks"])
+    warnings = []
+    if not text and backend.empty_text:
+        warnings.append(backend.empty_text)
+        text = backend.empty_text
+    elif backend.paged:
+        bounds = state["page_offsets"] + [len(text)]
+        empty_pages = sum(1 for page_start, page_end in zip(bounds, bounds[1:]) if page_start == page_end)
+        if empty_pages:
+            warnings.append(f"{empty_pages} page(s) had no extractable text (scanned images?)")
+
+    result = ExtractionResult(
+        text=text,
+        page_offsets=state["page_offsets"],
+        warnings=warnings,
+        timings=timings,
+        backend=backend.name,
+        sha256=digest,
+    )
+    if key:
+        put_record(key, {"text": text, "page_offsets": result.page_offsets, "warnings": warnings})
+    timings["total"] = time.perf_counter() - started
+    _record_stats(backend.name, len(file_content), timings["total"])
+    return result
+
+
+def _parse_whole_in_pool(backend, file_content):
+    """Plain text is cheap to decode in-thread; large PDFs are better split into page ranges."""
+    if not backend.cacheable:
+        return False
+    return not backend.paged or len(file_content) <= WHOLE_FILE_MAX_BYTES
+
+
+def _extract_whole_file(loader, source):
+    """Parses a whole file given as a path or bytes and returns its chunks. Runs inside pool workers."""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            source = f.read()
+    return list(loader()(source, 0))
+
+
+def _extract_in_pool(backend, file_content, state, on_progress):
+    """Returns the chunks of a file parsed whole in the process pool, or None if the pool broke."""
+    import pdf_extraction
+
+    # Workers open a spooled upload by path instead of receiving a pickled copy of the bytes
+    source = file_content.path if isinstance(file_content, SpooledUpload) else bytes(file_content)
+    try:
+        # The loader (a module-level function) is sent by reference and imports its library in the worker
+        future = pdf_extraction._get_pool().submit(_extract_whole_file, backend.loader, source)
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except FutureTimeoutError:
+                if on_progress:
+                    try:
+                        on_progress(state)  # Lets the caller cancel while the file is parsed
+                    except Exception:
+                        future.cancel()
+                        raise
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); drop the pool and parse in-thread
+        pdf_extraction._reset_pool()
+        return None
+
+
+def _record_stats(backend_name, num_bytes, seconds, cache_hit=False):
+    with _stats_lock:
+        stats = _stats.setdefault(backend_name, {"files": 0, "bytes": 0, "seconds": 0.0, "cache_hits": 0})
+        stats["files"] += 1
+        stats["bytes"] += num_bytes
+        stats["seconds"] += seconds
+        if cache_hit: stats["cache_hits"] += 1
+
+
+def backend_stats():
+    """Returns per-backend counters of files, bytes, seconds and cache hits in this process."""
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
+
+
+# --- Built-in Backends ---
+# Each loader imports its library on first use and returns the chunk generator.
+
+def _load_pypdf2():
+    from pdf_extraction import iter_pdf_pages
+
+    def iter_chunks(file_content, start=0):
+        """Yields one chunk per PDF page (large PDFs are parsed in parallel)."""
+        for page_index, page_text, num_pages in iter_pdf_pages(file_content, start):
+            yield (page_text + "\n" if page_text else ""), page_index + 1, num_pages
+    return iter_chunks
+
+
+def _load_pymupdf():
+    import fitz
+
+    def iter_chunks(file_content, start=0):
+        """Yields one chunk per PDF page using PyMuPDF."""
+        if isinstance(file_content, SpooledUpload):
+            document = fitz.open(file_content.path, filetype="pdf")
+        else:
+            document = fitz.open(stream=file_content, filetype="pdf")
+        with document:
+            num_pages = document.page_count
+            for page_index in range(start, num_pages):
+                page_text = document[page_index].get_text()
+                yield (page_text + "\n" if page_text else ""), page_index + 1, num_pages
+    return iter_chunks
+
+
+def _load_python_docx():
+    import docx
+
+    def iter_chunks(file_content, start=0):
+        """Yields DOCX paragraphs in batches."""
+        with open_binary(file_content) as stream:
+            paragraphs = docx.Document(stream).paragraphs
+        total = len(paragraphs)
+        for i in range(start, total, DOCX_PARAGRAPHS_PER_CHUNK):
+            batch = "\n".join(para.text for para in paragraphs[i:i + DOCX_PARAGRAPHS_PER_CHUNK])
+            yield ("\n" + batch if i else batch), min(i + DOCX_PARAGRAPHS_PER_CHUNK, total), total
+    return iter_chunks
+
+
+def _load_utf8():
+    def iter_chunks(file_content, start=0):
+        """Yields the decoded contents of a TXT file as a single chunk."""
+        yield str(content_buffer(file_content), "utf-8", errors="replace"), 1, 1
+    return iter_chunks
+
+
+register_extractor(PDF_TYPE, ExtractorBackend(
+    name="pypdf2", loader=_load_pypdf2, requires=("PyPDF2",), priority=10, paged=True,
+    error_label="Error reading PDF", empty_text="Could not extract text (check PDF content).",
+), extension="pdf")
+# Faster, but only used when PyPDF2 is missing or EXTRACTOR_PDF_BACKEND=pymupdf is set
+register_extractor(PDF_TYPE, ExtractorBackend(
+    name="pymupdf", loader=_load_pymupdf, requires=("fitz",), priority=0, paged=True,
+    error_label="Error reading PDF", empty_text="Could not extract text (check PDF content).",
+))
+register_extractor(DOCX_TYPE, ExtractorBackend(
+    name="python-docx", loader=_load_python_docx, requires=("docx",), priority=10,
+    error_label="Error reading DOCX",
+), extension="docx")
+register_extractor(TXT_TYPE, ExtractorBackend(
+    name="utf-8", loader=_load_utf8, cacheable=False, error_label="Error reading TXT file",
+), extension="txt")
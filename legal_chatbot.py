@@ -1,21 +1,32 @@
-import streamlit as st
-import google.generativeai as genai
-import os
-from io import BytesIO
 import time # For simulating streaming delay if needed, and for UI updates
-
-# --- Potentially needed libraries for file extraction (install them) ---
-# You might need: pip install PyPDF2 python-docx
-try:
-    import PyPDF2
-except ImportError:
-    # Don't use st.warning here before set_page_config
-    PyPDF2 = None
-try:
-    import docx
-except ImportError:
-    # Don't use st.warning here before set_page_config
-    docx = None
+_script_started = time.perf_counter() # For the startup report (see startup_profile.py)
+import streamlit as st
+import functools
+from extraction_cache import cache_stats, clear_cache
+# File extraction libraries (PyPDF2, python-docx) are imported lazily by extractors.py on first use
+import extractors
+from upload_spool import SpooledUpload, memory_log
+import extraction_jobs
+import archive_ingest
+import document_store
+import retrieval
+import context_packer
+import context_builder
+from context_viewer import render_context_viewer
+import context_cache
+import response_cache
+from legal_prompts import case_law_prompt, provision_prompt
+import batch_lookup
+import llm_backends
+import llm_resilience
+import llm_telemetry
+import chat_memory
+import startup_profile
+import chat_transcripts
+import stream_coalescer
+import research_core
+# Tab modules (and pandas, plotly, google-generativeai) are imported when their tab is first opened
+startup_profile.record_cold_start("Module imports", time.perf_counter() - _script_started)
 
 # --- Page Config (MUST BE THE FIRST STREAMLIT COMMAND) ---
 st.set_page_config(
@@ -27,20 +38,32 @@ st.set_page_config(
 
 # --- Gemini API Configuration ---
 # Attempt to configure Gemini, store status in session state
+# LLM_BACKEND=local/replay runs the app against an offline stand-in instead (see llm_backends.py)
+@st.cache_resource(show_spinner=False)
+def get_llm_backend(api_key):
+    """Returns the LLM backend of the process; every session and tab shares it and its request pool (see llm_pool.py).
+
+    It is created in the background once the page has been painted (see the end of this script),
+    so importing the client library does not delay the first paint.
+    """
+    return llm_backends.DeferredBackend(api_key)
+
 if 'gemini_api_configured' not in st.session_state:
     st.session_state.gemini_api_configured = False
     st.session_state.gemini_error_message = None
     try:
-        GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-pro-preview-03-25')
+        GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"] if llm_backends.BACKEND == "gemini" else None
+        model = get_llm_backend(GEMINI_API_KEY)
         # Perform a quick test if possible, or assume configured if no exception
         st.session_state.gemini_api_configured = True
-        st.session_state.model = model # Store model in session state
+        st.session_state.model = model # Store (a reference to the shared) model in session state
     except KeyError:
         st.session_state.gemini_error_message = "Gemini API Key not found in Streamlit secrets (`.streamlit/secrets.toml`)."
     except Exception as e:
         st.session_state.gemini_error_message = f"Error configuring Gemini API: {e}"
+if st.session_state.gemini_api_configured and st.session_state.model.error is not None: # Creating it failed in the background
+    st.session_state.gemini_api_configured = False
+    st.session_state.gemini_error_message = f"Error configuring Gemini API: {st.session_state.model.error}"
 
 # --- Custom CSS for Styling ---
 # (CSS remains the same as before)
@@ -171,60 +194,56 @@ st.markdown("""
 
 # --- Display Global Errors/Warnings Early ---
 # (Error/Warning display remains the same)
-if not PyPDF2:
+missing_extractors = extractors.missing_backends()
+if extractors.PDF_TYPE in missing_extractors:
     st.warning("PyPDF2 library not found (`pip install PyPDF2`). PDF file processing will be disabled.", icon="⚠️")
-if not docx:
+if extractors.DOCX_TYPE in missing_extractors:
     st.warning("python-docx library not found (`pip install python-docx`). DOCX file processing will be disabled.", icon="⚠️")
 if not st.session_state.gemini_api_configured:
     st.error(f"**Gemini API Configuration Failed:** {st.session_state.gemini_error_message} AI features requiring Gemini will be disabled.", icon="🚨")
 
 
 # --- Text Extraction Functions ---
-# (Functions remain the same)
+# Thin wrappers over the shared extractor registry (see extractors.py)
+def _extract_text(file_content, file_type):
+    if not extractors.is_supported(file_type): return None
+    try: return extractors.extract(file_content, file_type).text
+    except extractors.ExtractionError as e: return str(e)
+
 def extract_text_from_pdf(file_content):
     """Extracts text from a PDF file stream."""
-    if not PyPDF2: return None
-    try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text: text += page_text + "\n"
-        return text if text else "Could not extract text (check PDF content)."
-    except Exception as e: return f"Error reading PDF: {e}"
+    return _extract_text(file_content, extractors.PDF_TYPE)
 
 def extract_text_from_docx(file_content):
     """Extracts text from a DOCX file stream."""
-    if not docx: return None
-    try:
-        document = docx.Document(BytesIO(file_content))
-        text = "\n".join([para.text for para in document.paragraphs])
-        return text
-    except Exception as e: return f"Error reading DOCX: {e}"
+    return _extract_text(file_content, extractors.DOCX_TYPE)
 
 def extract_text_from_txt(file_content):
     """Extracts text from a TXT file stream."""
-    try: return file_content.decode('utf-8', errors='replace')
-    except Exception as e: return f"Error reading TXT file: {e}"
+    return _extract_text(file_content, extractors.TXT_TYPE)
 
 # --- Gemini Interaction Function (Streaming) ---
 # (Function remains the same)
-def get_gemini_response_stream(prompt, context=""):
-    """Gets a streaming response generator from the Gemini API."""
+def get_gemini_response_stream(prompt, context="", cached_prefix=None, usage=None, kind="chat", cache_key=None):
+    """Gets a streaming response generator from the Gemini API.
+
+    With a cached_prefix (see context_cache.py) the document context is not sent again; context
+    then only holds what changes per turn, such as chat history. If a usage dict is given, the
+    cached token count reported by the API is stored in it. Each call is recorded in
+    llm_telemetry under kind ("chat", "case", "provision"); see research_core.py. With a
+    cache_key the answer is stored in response_cache.py, but only if it completed without error.
+    """
     if not st.session_state.get('gemini_api_configured', False) or 'model' not in st.session_state:
         yield "⚠️ AI features disabled: Gemini model not initialized or API key missing."
         return
 
-    model = st.session_state.model
-    full_prompt = prompt
-    if context:
-        full_prompt = f"Use the following context if relevant:\n--- CONTEXT START ---\n{context}\n--- CONTEXT END ---\n\nBased on the context (if relevant) and your general knowledge, answer the following question:\n{prompt}"
-
+    stream = research_core.stream_answer(st.session_state.model, prompt, context, cached_prefix, usage, kind)
+    if cache_key:
+        stream = response_cache.caching_stream(stream, cache_key) # Errors below are rendered outside the cached answer
     try:
-        response_stream = model.generate_content(full_prompt, stream=True)
-        for chunk in response_stream:
-            if chunk.parts:
-                yield chunk.text
+        yield from stream
+    except (llm_resilience.CircuitOpenError, llm_resilience.RateLimitedError) as e:
+        yield f"\n\n⚠️ {e}"
     except Exception as e:
         yield f"\n\n[An error occurred while contacting the AI: {e}]"
 
@@ -234,11 +253,33 @@ st.title("🏛️ Chatbot Assistant")
 st.caption("Your AI-powered research companion")
 
 # --- Initialize Session State (if not already done) ---
+CHAT_PAGE_MESSAGES = 20 # Messages rendered per "load older" page of the chat history
 # (Initialization remains the same)
-if 'chat_history' not in st.session_state: st.session_state.chat_history = []
-if 'uploaded_file_text' not in st.session_state: st.session_state.uploaded_file_text = {}
+if 'chat_id' not in st.session_state: # Kept in the URL so a reload restores the chat from its transcript
+    chat_id = st.query_params.get("chat")
+    st.session_state.chat_id = chat_id if chat_transcripts.is_valid_chat_id(chat_id) else chat_transcripts.new_chat_id()
+    st.query_params["chat"] = st.session_state.chat_id
+if 'user_id' not in st.session_state: # Owner of the documents this browser stores; only they are listed back to it
+    user_id = st.query_params.get("user")
+    st.session_state.user_id = user_id if chat_transcripts.is_valid_chat_id(user_id) else chat_transcripts.new_chat_id()
+    st.query_params["user"] = st.session_state.user_id
+st.session_state.page_runs = st.session_state.get('page_runs', 0) + 1 # full script runs; fragment-only reruns don't count
+if 'chat_history' not in st.session_state: st.session_state.chat_history = chat_transcripts.load(st.session_state.chat_id)
+if 'chat_window' not in st.session_state: st.session_state.chat_window = CHAT_PAGE_MESSAGES # number of most recent messages rendered
+if 'chat_memory' not in st.session_state: st.session_state.chat_memory = chat_memory.ConversationMemory() # rolling summary of older chat messages
+if 'loaded_documents' not in st.session_state: st.session_state.loaded_documents = {} # filename -> document id; texts live in document_store
+if 'context_prefix' not in st.session_state: st.session_state.context_prefix = None # cached document-context prefix (context_cache.CachedPrefix) this session holds
+if 'last_retrieval' not in st.session_state: st.session_state.last_retrieval = None # passages chosen for the last chat question
+if 'extraction_jobs' not in st.session_state: st.session_state.extraction_jobs = {} # filename -> id of its background extraction job
+if 'extraction_report' not in st.session_state: st.session_state.extraction_report = None # outcome of the last finished extractions
+if 'archive_ingests' not in st.session_state: st.session_state.archive_ingests = {} # archive name -> id of its background ingest
+if 'archive_reports' not in st.session_state: st.session_state.archive_reports = [] # summaries of finished archive ingests
+if 'processed_upload_ids' not in st.session_state: st.session_state.processed_upload_ids = set() # uploads already handled, even if they failed
 if 'case_search_result_stream' not in st.session_state: st.session_state.case_search_result_stream = None
 if 'provision_search_result_stream' not in st.session_state: st.session_state.provision_search_result_stream = None
+if 'case_search_cached_at' not in st.session_state: st.session_state.case_search_cached_at = None # set when the result is replayed from the response cache
+if 'provision_search_cached_at' not in st.session_state: st.session_state.provision_search_cached_at = None
+if 'provision_batch_id' not in st.session_state: st.session_state.provision_batch_id = None # running or last batch provision lookup
 
 
 # --- Sidebar ---
@@ -247,47 +288,279 @@ with st.sidebar:
     st.header("⚙️ Settings & Status")
     st.divider()
     st.subheader("API Status")
-    if st.session_state.gemini_api_configured:
+    if st.session_state.gemini_api_configured and llm_backends.BACKEND != "gemini":
+        model_name = f" ({st.session_state.model.model_name})" if st.session_state.model.ready else ""
+        st.info(f"🧪 Offline LLM backend: {st.session_state.model.name}{model_name}")
+    elif st.session_state.gemini_api_configured:
         st.success("✅ Gemini API Connected", icon="🔗")
     else:
         st.error("❌ Gemini API Disconnected", icon="🔌")
         st.caption(st.session_state.gemini_error_message)
+    if st.session_state.gemini_api_configured and not st.session_state.model.ready:
+        st.caption("Shared client: connecting…")
+    elif st.session_state.gemini_api_configured:
+        pool_stats = st.session_state.model.pool_stats()
+        st.caption(
+            f"Shared client: {pool_stats['in_use']}/{pool_stats['size']} request slots in use (peak {pool_stats['peak']}) · "
+            f"{pool_stats['utilization']:.0%} utilization · {pool_stats['waited']} of {pool_stats['requests']} requests waited"
+            + (f" (avg {pool_stats['avg_wait_seconds']:.1f}s)" if pool_stats['waited'] else "")
+        )
+        llm_status = llm_resilience.status()
+        if llm_status['state'] == llm_resilience.OPEN:
+            st.error(f"⛔ AI requests paused for {llm_status['retry_in']:.0f}s after repeated errors", icon="🚦")
+            st.caption(f"Last error: {llm_status['last_error']}")
+        elif llm_status['state'] == llm_resilience.HALF_OPEN:
+            st.warning("🚦 Checking whether the AI service has recovered", icon="⏳")
+        st.caption(
+            f"{llm_status['requests']} requests · {llm_status['retries']} retries · {llm_status['resumed']} resumed · "
+            f"{llm_status['rate_limited'] + llm_status['fast_failed']} rejected · "
+            f"{llm_status['tokens_available']:.0f}/{llm_status['burst']} request slots free "
+            f"({llm_status['rate_per_minute']:.0f}/min)"
+        )
+    st.divider()
+    st.subheader("Extraction Cache")
+    extraction_stats = cache_stats()
+    st.caption(
+        f"{extraction_stats['hits']} hits / {extraction_stats['misses']} misses "
+        f"({extraction_stats['hit_rate']:.0%} hit rate) · "
+        f"{extraction_stats['size_bytes'] / (1024 * 1024):.1f} of {extraction_stats['max_bytes'] / (1024 * 1024):.0f} MB used"
+    )
+    for backend_name, stats in extractors.backend_stats().items():
+        st.caption(
+            f"`{backend_name}`: {stats['files']} file(s), "
+            f"{stats['bytes'] / (1024 * 1024):.1f} MB in {stats['seconds']:.1f}s "
+            f"({stats['cache_hits']} from cache)"
+        )
+    if st.button("🧹 Clear Extraction Cache", use_container_width=True, help="Deletes cached document text shared by all sessions."):
+        clear_cache()
+        st.rerun()
+    st.divider()
+    st.subheader("Response Cache")
+    answer_stats = response_cache.cache_stats()
+    st.caption(
+        f"Case law and provision answers: {answer_stats['hits']} hits / {answer_stats['misses']} misses "
+        f"({answer_stats['hit_rate']:.0%} hit rate) · "
+        f"{answer_stats['size_bytes'] / (1024 * 1024):.1f} of {answer_stats['max_bytes'] / (1024 * 1024):.0f} MB used"
+    )
+    if st.button("🧹 Clear Response Cache", use_container_width=True, help="Deletes cached case law and provision answers shared by all sessions."):
+        response_cache.clear_cache()
+        st.rerun()
+    store_stats = document_store.store_stats()
+    st.caption(
+        f"Document store: {store_stats['documents']} document(s), {store_stats['chars'] / 1e6:.1f}M characters "
+        f"in {store_stats['disk_bytes'] / (1024 * 1024):.1f} MB on disk (limit {store_stats['max_bytes'] / (1024 * 1024):.0f} MB) · "
+        f"{store_stats['cached_chars'] / 1e6:.1f}M characters held in memory"
+    )
+    st.divider()
+    st.subheader("Context Budget")
+    for tab_name, default_budget in context_packer.DEFAULT_BUDGETS.items():
+        st.number_input(
+            f"{tab_name} (tokens)",
+            min_value=1000,
+            max_value=context_packer.MODEL_CONTEXT_TOKENS,
+            value=default_budget,
+            step=10000,
+            key=f"token_budget_{tab_name}",
+            help="Upper bound on file passages and chat history sent with each question. Smaller budgets answer faster and cost less."
+        )
+    st.caption(f"Estimated at ${context_packer.INPUT_PRICE_PER_M:.2f} / ${context_packer.OUTPUT_PRICE_PER_M:.2f} per million input / output tokens.")
+    memo_stats = context_builder.memo_stats()
+    st.caption(f"Packed file context reused {memo_stats['hits']} times, rebuilt {memo_stats['misses']} times ({memo_stats['entries']} kept).")
+    prefix_stats = context_cache.cache_stats()
+    st.caption(
+        f"Context cache (`{prefix_stats['backend']}`): {prefix_stats['active']} active prefix(es), "
+        f"reused {prefix_stats['uses']} times, ~{prefix_stats['saved_tokens']:,} tokens not re-sent"
+    )
+    st.divider()
+    st.subheader("Diagnostics")
+    telemetry_rows = llm_telemetry.summary()
+    if telemetry_rows:
+        fmt = lambda value, spec: "–" if value is None else format(value, spec)
+        st.caption(f"AI calls in this process (last {llm_telemetry.WINDOW}), p50 / p95:")
+        st.dataframe([{
+            "Calls": row['kind'],
+            "n": row['calls'],
+            "Errors": f"{row['error_rate']:.0%}",
+            "Cancelled": row['cancelled'],
+            "Prompt tokens": f"{fmt(row['prompt_tokens_p50'], ',.0f')} / {fmt(row['prompt_tokens_p95'], ',.0f')}",
+            "First token (s)": f"{fmt(row['ttft_p50'], '.2f')} / {fmt(row['ttft_p95'], '.2f')}",
+            "Tokens/s": f"{fmt(row['tokens_per_second_p50'], '.0f')} / {fmt(row['tokens_per_second_p95'], '.0f')}",
+            "Duration (s)": f"{fmt(row['duration_p50'], '.1f')} / {fmt(row['duration_p95'], '.1f')}",
+        } for row in telemetry_rows], hide_index=True, use_container_width=True)
+        st.download_button(
+            "⬇️ Export AI Call Metrics (JSONL)",
+            data=llm_telemetry.to_jsonl(),
+            file_name=f"llm_calls_{time.strftime('%Y%m%d_%H%M%S')}.jsonl",
+            mime="application/jsonl",
+            use_container_width=True,
+        )
+    else:
+        st.caption("No AI calls recorded yet.")
+    stream_stats = stream_coalescer.coalesce_stats()
+    if stream_stats['answers']:
+        st.caption(
+            f"Streaming: {stream_stats['deltas'] / stream_stats['answers']:.0f} UI updates per answer for "
+            f"{stream_stats['chunks'] / stream_stats['answers']:.0f} chunks received "
+            f"(coalesced by {stream_coalescer.COALESCE_SECONDS * 1000:.0f} ms / {stream_coalescer.COALESCE_CHARS} chars)"
+        )
+    with st.expander("Startup & Rerun Times"):
+        startup = startup_profile.report()
+        st.caption("Cold start: " + (" · ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup['cold_start']) or "–"))
+        for row in startup['runs']:
+            st.caption(f"{row['tab']}: {row['p50'] * 1000:.0f} / {row['p95'] * 1000:.0f} ms per full page run (p50 / p95, {row['runs']} runs)")
+        tab_runs = startup_profile.tab_timing()
+        if tab_runs['runs']:
+            st.caption(f"Tab bodies: {tab_runs['p50'] * 1000:.0f} / {tab_runs['p95'] * 1000:.0f} ms (p50 / p95), {tab_runs['isolated']} of {tab_runs['runs']} runs tab-only")
+        if startup['imports']:
+            st.caption("Modules imported on first use: " + " · ".join(f"`{name}` {seconds:.2f}s" for name, seconds in startup['imports']))
     st.divider()
     st.subheader("Manage Session")
     if st.button("⚠️ Clear All Session Data", use_container_width=True, help="Clears chat history, uploaded files, and search results."):
-        keys_to_clear = ['chat_history', 'uploaded_file_text', 'case_search_result_stream', 'provision_search_result_stream']
+        for job_id in st.session_state.extraction_jobs.values():
+            extraction_jobs.cancel(job_id)
+        for ingest_id in st.session_state.archive_ingests.values():
+            archive_ingest.cancel(ingest_id)
+        if st.session_state.context_prefix:
+            context_cache.release(st.session_state.context_prefix)
+        if st.session_state.provision_batch_id:
+            batch_lookup.forget(st.session_state.provision_batch_id)
+        keys_to_clear = ['chat_history', 'chat_memory', 'loaded_documents', 'last_retrieval', 'context_prefix', 'extraction_jobs', 'archive_ingests', 'archive_reports', 'processed_upload_ids', 'extraction_report', 'case_search_result_stream', 'provision_search_result_stream', 'case_search_cached_at', 'provision_search_cached_at', 'provision_batch_id']
         for key in keys_to_clear:
             if key in st.session_state:
-                if key == 'chat_history': st.session_state[key] = []
-                elif key == 'uploaded_file_text': st.session_state[key] = {}
+                if key in ('chat_history', 'archive_reports'): st.session_state[key] = []
+                elif key in ('loaded_documents', 'extraction_jobs', 'archive_ingests'): st.session_state[key] = {}
+                elif key == 'processed_upload_ids': st.session_state[key] = set()
+                elif key == 'chat_memory': st.session_state[key] = chat_memory.ConversationMemory()
                 else: st.session_state[key] = None
+        st.session_state.chat_id = chat_transcripts.new_chat_id() # Start a new transcript; the old one stays on disk
+        st.query_params["chat"] = st.session_state.chat_id
+        st.session_state.chat_window = CHAT_PAGE_MESSAGES
         st.success("Session data cleared!", icon="🧹")
         time.sleep(1)
         st.rerun()
 
+# --- Background Extraction Results ---
+def collect_extraction_jobs():
+    """Adds the documents of this session's finished background extractions to the context."""
+    success_count = 0
+    errors = []
+    warnings = []
+    for filename, job_id in list(st.session_state.extraction_jobs.items()):
+        job = extraction_jobs.get_job(job_id)
+        if job is not None and not job.finished: continue
+        del st.session_state.extraction_jobs[filename]
+        if job is None: continue # Dropped from the job table (e.g. server restart)
+        if job.status == extraction_jobs.DONE:
+            st.session_state.loaded_documents[filename] = job.doc_id
+            document_store.add_owner(job.doc_id, st.session_state.user_id)
+            warnings.extend(f"{filename}: {warning}" for warning in job.result.warnings)
+            success_count += 1
+        elif job.status == extraction_jobs.FAILED:
+            errors.append(f"{filename} ({job.error})")
+        extraction_jobs.forget(job_id)
+    if success_count or errors:
+        st.session_state.extraction_report = {"success_count": success_count, "errors": errors, "warnings": warnings}
+
+def collect_archive_ingests():
+    """Adds the documents of this session's finished ZIP ingests to the context, named archive/member."""
+    for archive_name, ingest_id in list(st.session_state.archive_ingests.items()):
+        ingest = archive_ingest.get_ingest(ingest_id)
+        if ingest is not None and not ingest.finished: continue
+        del st.session_state.archive_ingests[archive_name]
+        if ingest is None: continue
+        for member_name, doc_id in ingest.results.items():
+            st.session_state.loaded_documents[f"{archive_name}/{member_name}"] = doc_id
+            document_store.add_owner(doc_id, st.session_state.user_id)
+        files_per_second, mb_per_second = ingest.throughput()
+        st.session_state.archive_reports.append({
+            "name": archive_name,
+            "error": ingest.error,
+            "extracted": len(ingest.results),
+            "errors": [f"{member} ({error})" for member, error in ingest.errors.items()],
+            "duplicates": len(ingest.duplicates),
+            "skipped": [f"{member} ({reason})" for member, reason in ingest.skipped],
+            "seconds": ingest.finished_at - ingest.started_at,
+            "megabytes": ingest.bytes_read / (1024 * 1024),
+            "files_per_second": files_per_second,
+            "mb_per_second": mb_per_second,
+        })
+        archive_ingest.forget(ingest_id)
+
+# Results land in session state on whichever rerun happens after a job finishes, in any tab
+collect_extraction_jobs()
+collect_archive_ingests()
+
 # --- Build Combined Context ---
-# (Function remains the same)
-def get_combined_context():
-    """Combines text from uploaded files."""
-    context = ""
-    if st.session_state.uploaded_file_text:
-        context += "Context from Uploaded Files:\n"
-        total_len = 0
-        max_len = 2000000
-        for filename, text in st.session_state.uploaded_file_text.items():
-            preview_len = min(len(text), max_len - total_len)
-            if preview_len <= 0: break
-            context += f"--- Start {filename} ---\n{text[:preview_len]}...\n--- End {filename} ---\n\n"
-            total_len += preview_len + len(f"--- Start {filename} ---\n...\n--- End {filename} ---\n\n")
-        context += "---\n"
-    return context.strip()
-
-
-# --- Import Tab Modules ---
-from document_comparison import compare_documents, extract_text_from_uploaded_file
-from citation_generator import citation_generator_tab
-from deadline_tracker import deadline_tracker_tab
-from advanced_search import advanced_search_tab
+# Documents and chat history are packed into the tab's token budget (see context_packer.py);
+# the full-document context is memoized per set of loaded documents (see context_builder.py)
+def token_budget(tab):
+    """Returns the context token budget chosen in the sidebar for a tab."""
+    return st.session_state.get(f"token_budget_{tab}", context_packer.DEFAULT_BUDGETS[tab])
+
+def history_pieces(messages):
+    """Turns chat messages into context pieces for the packer: the rolling summary of older
+    messages (or None) and the messages it does not cover yet (see chat_memory.py)."""
+    return chat_memory.memory_pieces(st.session_state.chat_memory, messages)
+
+def get_document_context(budget):
+    """Returns the packed file context handle for this session's documents.
+
+    Memoized by the set of loaded documents (see context_builder.py), so it is only rebuilt
+    when a document is added or removed. The history share of the budget is always reserved
+    so the handle is the same with or without chat history. Files still being extracted are
+    packed afresh on every call, with the pages extracted so far.
+    """
+    document_budget = budget - int(budget * context_packer.HISTORY_SHARE)
+    partial = []
+    for filename, job_id in st.session_state.extraction_jobs.items():
+        job = extraction_jobs.get_job(job_id)
+        if job is not None and job.status == extraction_jobs.RUNNING and job.state["done"]:
+            partial.append(context_packer.Piece(f"{filename} (partial: {job.state['done']} of {job.state['total']} parts extracted)", job.partial_text()))
+    if not partial:
+        return context_builder.document_context(st.session_state.loaded_documents.items(), document_budget)
+    files = []
+    for filename, doc_id in st.session_state.loaded_documents.items():
+        text = document_store.get_text(doc_id) # Read lazily; recently used texts are cached in memory
+        if text is not None: files.append(context_packer.Piece(filename, text, doc_id=doc_id))
+    return context_builder.build_document_context(files + partial, document_budget)
+
+def get_combined_context(budget, history=()):
+    """Combines packed chat history with the full text of uploaded files.
+
+    Every file gets a fair share of the budget; only files larger than their share are truncated.
+    """
+    documents = get_document_context(budget)
+    summary, turns = history_pieces(history)
+    turns = context_packer.pack_history(turns, int(budget * context_packer.HISTORY_SHARE), summary)
+    return context_builder.compose(turns, documents.text, documents.tokens, documents=documents)
+
+def get_relevant_context(query, budget, history=(), k=retrieval.TOP_K):
+    """Packs the uploaded-file passages most relevant to query (BM25, see retrieval.py) by score.
+
+    The chosen passages and their scores are kept in session state for the context expander.
+    """
+    names = {doc_id: filename for filename, doc_id in st.session_state.loaded_documents.items()}
+    partial_documents = []
+    for filename, job_id in st.session_state.extraction_jobs.items():
+        job = extraction_jobs.get_job(job_id)
+        if job is not None and job.status == extraction_jobs.RUNNING and job.state["done"]:
+            names[f"job-{job_id}"] = f"{filename} (partial)"
+            partial_documents.append((f"job-{job_id}", job.partial_text()))
+    partial_texts = dict(partial_documents)
+    passages = []
+    for score, chunk in retrieval.retrieve(query, st.session_state.loaded_documents.values(), k, partial_documents):
+        text = partial_texts.get(chunk.doc_id) or document_store.get_text(chunk.doc_id) or ""
+        location = f", page {chunk.page}" if chunk.page else ""
+        passages.append(context_packer.Piece(f"{names.get(chunk.doc_id, chunk.doc_id)}{location}", chunk.text(text), priority=score))
+    summary, turns = history_pieces(history)
+    packed = context_packer.pack(passages, turns, budget, ranked=True, summary=summary)
+    st.session_state.last_retrieval = {
+        "query": query,
+        "passages": [{"label": piece.label, "score": piece.priority, "tokens": piece.tokens, "text": piece.text} for piece in packed.pieces],
+    }
+    document_tokens = sum(piece.tokens + context_packer.PIECE_OVERHEAD_TOKENS for piece in packed.pieces)
+    return context_builder.compose(packed.history, context_builder.render_documents(packed.pieces), document_tokens)
+
 
 # --- Create Tabs (Reordered) ---
 tab_titles = [
@@ -300,10 +573,120 @@ tab_titles = [
     "📅 Deadline Tracker", # New feature
     "🔍 Advanced Search"   # New feature
 ]
-tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs(tab_titles) # Variables now map to the new order
+# Navigation instead of st.tabs: only the selected tab's body runs (and imports its modules) on each rerun
+active_tab = st.radio("Tool", tab_titles, horizontal=True, label_visibility="collapsed", key="active_tab")
+
+# --- Extraction Progress (polls the background job table) ---
+@st.fragment(run_every=1.0)
+def render_extraction_progress():
+    """Shows progress of this session's background extractions, refreshing only this fragment every second."""
+    st.caption("Files are extracted in the background; you can keep chatting while this runs. Pages extracted so far are already used as chat context.")
+    any_finished = False
+    for filename, job_id in list(st.session_state.extraction_jobs.items()):
+        job = extraction_jobs.get_job(job_id)
+        if job is None or job.finished:
+            any_finished = True
+            continue
+        col1, col2 = st.columns([0.85, 0.15])
+        with col1:
+            if job.status == extraction_jobs.QUEUED:
+                st.progress(0.0, text=f"🕒 {filename}: queued for {job.elapsed():.0f}s")
+            else:
+                unit = "pages" if job.file_type == extractors.PDF_TYPE else "parts"
+                done, total = job.state["done"], job.state["total"] or "?"
+                st.progress(job.progress(), text=f"⏳ {filename}: {done} of {total} {unit} · {job.elapsed():.1f}s")
+        with col2:
+            if st.button("✖️ Cancel", key=f"cancel_job_{job_id}", use_container_width=True):
+                extraction_jobs.cancel(job_id)
+    for archive_name, ingest_id in list(st.session_state.archive_ingests.items()):
+        ingest = archive_ingest.get_ingest(ingest_id)
+        if ingest is None or ingest.finished:
+            any_finished = True
+            continue
+        col1, col2 = st.columns([0.85, 0.15])
+        with col1:
+            files_per_second, mb_per_second = ingest.throughput()
+            progress = ingest.completed / ingest.total if ingest.total else 0.0
+            st.progress(progress, text=(
+                f"📦 {archive_name}: {ingest.completed} of {ingest.total} files "
+                f"({len(ingest.duplicates)} duplicates skipped) · {files_per_second:.1f} files/s, {mb_per_second:.1f} MB/s"
+            ))
+        with col2:
+            if st.button("✖️ Cancel", key=f"cancel_ingest_{ingest_id}", use_container_width=True):
+                archive_ingest.cancel(ingest_id)
+    counts = extraction_jobs.job_counts()
+    st.caption(f"Server extraction queue: {counts[extraction_jobs.QUEUED]} queued, {counts[extraction_jobs.RUNNING]} running (all users)")
+    if any_finished:
+        st.rerun() # Full rerun so results are collected and shown in every tab
+
+# --- Batch Provision Lookup Progress (polls the batch) ---
+def show_provision_batch(batch):
+    """Shows each provision of a batch in its own panel, with progress and the Markdown export."""
+    elapsed = (batch.finished_at or time.time()) - batch.started_at
+    col1, col2 = st.columns([0.85, 0.15])
+    with col1:
+        st.progress(batch.completed / len(batch.items), text=f"{batch.completed} of {len(batch.items)} provisions · {elapsed:.1f}s · {batch.concurrency} in parallel")
+    with col2:
+        if not batch.finished and st.button("✖️ Cancel", key=f"cancel_batch_{batch.id}", use_container_width=True):
+            batch_lookup.cancel(batch.id)
+    if batch.finished:
+        st.download_button(
+            "⬇️ Download All as Markdown",
+            data=batch_lookup.to_markdown(batch),
+            file_name="provision_lookup.md",
+            mime="text/markdown",
+            key=f"download_batch_{batch.id}",
+            use_container_width=True
+        )
+    icons = {batch_lookup.QUEUED: "🕒", batch_lookup.RUNNING: "⏳", batch_lookup.DONE: "✅", batch_lookup.FAILED: "❗", batch_lookup.CANCELLED: "✖️"}
+    for item in batch.items:
+        if item.cached: timing = " · cached"
+        elif item.latency is not None: timing = f" · {item.latency:.1f}s"
+        else: timing = ""
+        with st.expander(f"{icons[item.status]} {item.term}{timing}", expanded=False):
+            if item.status == batch_lookup.FAILED:
+                st.error(item.error, icon="❗")
+            elif item.chunks:
+                st.markdown(item.text)
+            else:
+                st.caption(f"{item.status.capitalize()}…")
+
+@st.fragment(run_every=1.0)
+def render_provision_batch():
+    """Shows a running batch, refreshing only this fragment every second."""
+    batch = batch_lookup.get_batch(st.session_state.provision_batch_id)
+    if batch is None or batch.finished:
+        st.rerun() # Full rerun renders the finished batch once, without polling
+    show_provision_batch(batch)
+
+# --- Tab Fragments ---
+# Each tab body is a fragment: using a widget in a tab reruns only that tab, not the sidebar,
+# the page setup or other tabs (st.rerun() inside a tab still reruns the whole page). A timer
+# at the bottom of each tab shows what its runs cost and how many were tab-only.
+def tab_fragment(tab):
+    """Turns a tab body into a fragment that times each of its runs (see startup_profile.py)."""
+    def decorate(body):
+        @st.fragment
+        @functools.wraps(body)
+        def run():
+            started = time.perf_counter()
+            isolated = st.session_state.get(f"tab_seen_run_{tab}") == st.session_state.page_runs
+            st.session_state[f"tab_seen_run_{tab}"] = st.session_state.page_runs
+            body()
+            seconds = time.perf_counter() - started
+            startup_profile.record_tab_run(tab, seconds, isolated)
+            timing = startup_profile.tab_timing(tab)
+            st.caption(
+                f"⏱️ This tab ran in {seconds * 1000:.0f} ms ({'tab-only rerun' if isolated else 'full page run'}) · "
+                f"p50 {timing['p50'] * 1000:.0f} ms / p95 {timing['p95'] * 1000:.0f} ms · "
+                f"{timing['isolated']} of {timing['runs']} runs were tab-only"
+            )
+        return run
+    return decorate
 
 # --- Tab 1: Upload Files (Content remains the same) ---
-with tab1:
+@tab_fragment(tab_titles[0])
+def upload_files_tab():
     st.header("📄 Upload Documents for Context")
     st.info("Upload PDF, DOCX, or TXT files. Extracted text provides context for the 'General Chat' tab.", icon="💡")
 
@@ -317,81 +700,190 @@ with tab1:
         )
 
         if uploaded_files:
-            with st.spinner("⏳ Processing uploaded files..."):
-                newly_uploaded_text = {}
-                errors = []
-                success_count = 0
-                for uploaded_file in uploaded_files:
-                    filename = uploaded_file.name
-                    if filename not in st.session_state.uploaded_file_text:
-                        file_content = uploaded_file.getvalue()
-                        text_or_error = None
-                        file_type = uploaded_file.type
-
-                        if file_type == "application/pdf":
-                            if PyPDF2: text_or_error = extract_text_from_pdf(file_content)
-                            else: errors.append(f"{filename} (PDF library missing)")
-                        elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                            if docx: text_or_error = extract_text_from_docx(file_content)
-                            else: errors.append(f"{filename} (DOCX library missing)")
-                        elif file_type == "text/plain":
-                            text_or_error = extract_text_from_txt(file_content)
-                        else:
-                            errors.append(f"{filename} (unsupported type: {file_type})")
-
-                        if isinstance(text_or_error, str) and not text_or_error.startswith("Error"):
-                            newly_uploaded_text[filename] = text_or_error
-                            success_count += 1
-                        elif isinstance(text_or_error, str):
-                             errors.append(f"{filename} ({text_or_error})")
+            errors = []
+            for uploaded_file in uploaded_files:
+                filename = uploaded_file.name
+                upload_id = getattr(uploaded_file, "file_id", None) or (filename, uploaded_file.size)
+                # Skip uploads already handled on an earlier rerun (including failed or removed ones)
+                if upload_id in st.session_state.processed_upload_ids: continue
+                st.session_state.processed_upload_ids.add(upload_id)
+                if filename in st.session_state.loaded_documents or filename in st.session_state.extraction_jobs: continue
+
+                file_type = uploaded_file.type
+                if not extractors.is_supported(file_type):
+                    if file_type == extractors.PDF_TYPE: errors.append(f"{filename} (PDF library missing)")
+                    elif file_type == extractors.DOCX_TYPE: errors.append(f"{filename} (DOCX library missing)")
+                    else: errors.append(f"{filename} (unsupported type: {file_type})")
+                    continue
+
+                # Spool the upload to a temp file once and extract it in the background; the
+                # job parses it through a memory map and deletes the temp file when done
+                spooled = SpooledUpload(uploaded_file)
+                st.session_state.extraction_jobs[filename] = extraction_jobs.submit(spooled, file_type, filename)
+                st.session_state.extraction_report = None
 
-                st.session_state.uploaded_file_text.update(newly_uploaded_text)
-
-            if success_count > 0:
-                 st.success(f"✅ Successfully processed {success_count} new file(s).", icon="👍")
             if errors:
                  st.error(f"⚠️ Could not fully process some files: {'; '.join(errors)}", icon="❗")
 
+        with st.expander("📦 Bulk Ingest a ZIP Archive of Case Files", expanded=False):
+            st.caption("PDF, DOCX and TXT files inside the archive are extracted in parallel; identical files are only processed once.")
+            uploaded_archives = st.file_uploader(
+                "Choose ZIP archives",
+                accept_multiple_files=True,
+                type=['zip'],
+                key="archive_uploader",
+                help="Folders inside the archive are kept in the document names."
+            )
+            for uploaded_archive in uploaded_archives or []:
+                archive_name = uploaded_archive.name
+                upload_id = getattr(uploaded_archive, "file_id", None) or (archive_name, uploaded_archive.size)
+                if upload_id in st.session_state.processed_upload_ids: continue
+                st.session_state.processed_upload_ids.add(upload_id)
+                if archive_name in st.session_state.archive_ingests: continue
+                st.session_state.archive_ingests[archive_name] = archive_ingest.start_zip_ingest(SpooledUpload(uploaded_archive))
+
+            for report in st.session_state.archive_reports[::-1]:
+                if report["error"]:
+                    st.error(f"⚠️ {report['name']}: {report['error']}", icon="❗")
+                st.success(
+                    f"✅ {report['name']}: {report['extracted']} file(s) extracted, {report['duplicates']} duplicate(s) skipped "
+                    f"in {report['seconds']:.1f}s · {report['files_per_second']:.1f} files/s, {report['mb_per_second']:.1f} MB/s "
+                    f"({report['megabytes']:.1f} MB)",
+                    icon="📦"
+                )
+                if report["errors"]:
+                    st.error(f"⚠️ Could not process: {'; '.join(report['errors'])}", icon="❗")
+                if report["skipped"]:
+                    st.caption(f"Skipped: {'; '.join(report['skipped'])}")
+
+        if st.session_state.extraction_jobs or st.session_state.archive_ingests:
+            render_extraction_progress()
+
+        report = st.session_state.extraction_report
+        if report:
+            if report["success_count"] > 0:
+                 st.success(f"✅ Successfully processed {report['success_count']} new file(s).", icon="👍")
+            if report["errors"]:
+                 st.error(f"⚠️ Could not fully process some files: {'; '.join(report['errors'])}", icon="❗")
+            for warning in report["warnings"]:
+                st.caption(f"ℹ️ {warning}")
+
+        if memory_log:
+            with st.expander("Memory Usage of Recent Uploads (this server process)", expanded=False):
+                mb = lambda value: f"{value / (1024 * 1024):.0f} MB" if value is not None else "n/a"
+                for entry in list(memory_log)[-10:][::-1]:
+                    st.caption(
+                        f"**{entry['name']}** ({mb(entry['size'])}, {entry['seconds']:.1f}s): "
+                        f"RSS {mb(entry['rss_before'])} → {mb(entry['rss_after'])}, "
+                        f"peak RSS {mb(entry['peak_rss'])} (+{mb(entry['peak_increase'])})"
+                    )
+
     st.divider()
     st.subheader("📚 Currently Loaded Files for Context")
-    if st.session_state.uploaded_file_text:
-        loaded_files = list(st.session_state.uploaded_file_text.keys())
-        for filename in loaded_files:
-             if filename in st.session_state.uploaded_file_text:
+    if st.session_state.loaded_documents:
+        loaded_files = list(st.session_state.loaded_documents.items())
+        for filename, doc_id in loaded_files:
+             if filename in st.session_state.loaded_documents:
                 with st.container(border=True):
                     col1, col2 = st.columns([0.85, 0.15])
                     with col1:
                         st.markdown(f"**📄 {filename}**")
+                        metadata = document_store.get_metadata(doc_id)
+                        if metadata is None:
+                            st.caption("⚠️ No longer in the document store; remove and upload it again.")
+                        else:
+                            pages = f"{metadata['pages']} pages · " if metadata["pages"] else ""
+                            st.caption(f"{pages}{metadata['chars']:,} characters · {metadata['size'] / 1024:,.0f} KB · stored {time.strftime('%Y-%m-%d %H:%M', time.localtime(metadata['uploaded_at']))}")
                     with col2:
                         if st.button(f"🗑️ Remove", key=f"remove_{filename}", help=f"Remove {filename} from context", use_container_width=True):
-                            if filename in st.session_state.uploaded_file_text:
-                                del st.session_state.uploaded_file_text[filename]
+                            if filename in st.session_state.loaded_documents:
+                                del st.session_state.loaded_documents[filename]
                             st.rerun()
     else:
         st.info("No files loaded yet. Upload documents above to add context.", icon="📁")
 
+    # Documents this user extracted earlier (in any session, before restarts) can be loaded again without re-uploading
+    loaded_ids = set(st.session_state.loaded_documents.values())
+    stored_documents = [doc for doc in document_store.list_documents(st.session_state.user_id) if doc["id"] not in loaded_ids]
+    if stored_documents:
+        with st.expander("🗄️ Previously Stored Documents", expanded=False):
+            for doc in stored_documents:
+                col1, col2 = st.columns([0.85, 0.15])
+                with col1:
+                    st.markdown(f"**{doc['filename']}**")
+                    st.caption(f"{doc['chars']:,} characters · last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(doc['last_used_at']))}")
+                with col2:
+                    if st.button("➕ Load", key=f"load_stored_{doc['id']}", help=f"Add {doc['filename']} to context", use_container_width=True):
+                        document_store.touch(doc["id"])
+                        st.session_state.loaded_documents[doc["filename"]] = doc["id"]
+                        st.rerun()
+
 
 # --- Tab 2: General Chat (Moved from original Tab 4) ---
-with tab2: # This now holds the General Chat content
+@tab_fragment(tab_titles[1])
+def general_chat_tab(): # This now holds the General Chat content
     st.header("💬 General Legal Chat")
     st.info("Ask general legal questions. Uploaded file content will be used as context. Responses stream in.", icon="💡")
 
+    context_mode = st.radio(
+        "File context sent with each question",
+        options=["Relevant passages", "Full documents"],
+        index=0,
+        horizontal=True,
+        key="chat_context_mode",
+        help="Relevant passages sends only the parts of your files that best match the question, which is faster and cheaper."
+    )
+    use_passages = context_mode == "Relevant passages"
+
     # Display current context summary
-    active_context = get_combined_context()
-    if active_context:
-        with st.expander("View Active File Context Being Sent to AI", expanded=False):
-            context_display = (active_context[:2000000] + '...') if len(active_context) > 2000000 else active_context
-            st.text_area("Context Preview:", value=context_display, height=200, disabled=True, key="context_display_chat_v4_tab2") # Unique key
+    if use_passages:
+        retrieval_result = st.session_state.last_retrieval
+        if retrieval_result and retrieval_result["passages"]:
+            with st.expander("View Passages Sent to AI With the Last Question", expanded=False):
+                st.caption(f"Top {len(retrieval_result['passages'])} passages for: *{retrieval_result['query']}*")
+                for passage in retrieval_result["passages"]:
+                    st.markdown(f"**{passage['label']}** · score {passage['score']:.2f} · ~{passage['tokens']:,} tokens")
+                    st.text(passage["text"][:500] + ("..." if len(passage["text"]) > 500 else ""))
+    else:
+        active_documents = get_document_context(token_budget("General Chat"))
+        if active_documents.text:
+            with st.expander("View Active File Context Being Sent to AI", expanded=False):
+                st.caption(f"~{active_documents.tokens:,} of {active_documents.budget:,} tokens" + (f" · left out: {', '.join(active_documents.dropped)}" if active_documents.dropped else ""))
+                render_context_viewer(active_documents, key="context_viewer_chat") # Sends only the visible page to the browser
 
     st.divider()
 
     # Chat History Area
     st.subheader("Conversation History")
+    memory = st.session_state.chat_memory
+    if memory.summarized or memory.updating:
+        st.caption(
+            f"🧠 The AI sees the last {chat_memory.RECENT_MESSAGES} messages verbatim"
+            + (f" and a summary of the {memory.summarized} before them" if memory.summarized else "")
+            + (" · updating summary…" if memory.updating else "")
+            + (f" · last summary update failed: {memory.last_error}" if memory.last_error else "")
+        )
     chat_container = st.container(height=500)
     with chat_container:
-        for message in st.session_state.chat_history:
+        # Only the most recent page(s) of messages are rendered, so reruns stay fast in long chats
+        hidden_messages = max(0, len(st.session_state.chat_history) - st.session_state.chat_window)
+        if hidden_messages:
+            if st.button(f"⬆️ Load older messages ({hidden_messages} hidden)", key="chat_load_older", use_container_width=True):
+                st.session_state.chat_window += CHAT_PAGE_MESSAGES
+                st.rerun(scope="fragment") # Only the chat tab needs to redraw
+        for message in st.session_state.chat_history[hidden_messages:]:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
+                usage = message.get("usage")
+                if usage:
+                    st.caption(
+                        f"~{usage['prompt_tokens']:,} prompt tokens ({usage['context_tokens']:,} context, "
+                        f"{usage['history_turns']} earlier turns"
+                        + (f", {usage['cached_tokens']:,} from cached prefix" if usage.get("cached_tokens") else "")
+                        + f") · ~{usage['output_tokens']:,} output tokens · "
+                        f"est. ${usage['cost']:.4f}"
+                        + (f" · {usage['deltas']} UI updates for {usage['chunks']} chunks" if usage.get("deltas") else "")
+                    )
 
     st.divider()
 
@@ -403,26 +895,62 @@ with tab2: # This now holds the General Chat content
     )
 
     if prompt:
+        earlier_turns = list(st.session_state.chat_history)
         st.session_state.chat_history.append({"role": "user", "content": prompt})
-        context_for_prompt = get_combined_context()
-        response_generator = get_gemini_response_stream(prompt, context=context_for_prompt)
+        chat_transcripts.append(st.session_state.chat_id, st.session_state.chat_history[-1])
+        budget = token_budget("General Chat")
+        prompt_context = get_relevant_context(prompt, budget, earlier_turns) if use_passages else get_combined_context(budget, earlier_turns)
+        context_for_prompt = prompt_context.text
+
+        # Full documents are a stable prefix: register it once and send only history and question afterwards
+        prefix = None
+        if prompt_context.documents is not None and st.session_state.gemini_api_configured:
+            prefix = context_cache.get_prefix(st.session_state.model, prompt_context.documents)
+        held_prefix = st.session_state.context_prefix
+        if prefix is not held_prefix: # Documents changed, or the held prefix expired and was registered again
+            if prefix is not None and not context_cache.acquire(prefix):
+                prefix = None # Its last other session just released it; send the documents this turn
+            if held_prefix is not None:
+                context_cache.release(held_prefix)
+            st.session_state.context_prefix = prefix
+        stream_usage = {}
+        if prefix is not None:
+            response_generator = get_gemini_response_stream(prompt, context=prompt_context.history_text, cached_prefix=prefix, usage=stream_usage)
+        else:
+            response_generator = get_gemini_response_stream(prompt, context=context_for_prompt)
 
         # Display stream and collect chunks within the chat container
         with chat_container:
              with st.chat_message("user"):
                  st.markdown(prompt)
              with st.chat_message("model"):
-                 full_response = st.write_stream(response_generator)
+                 stream_counts = {}
+                 full_response = st.write_stream(stream_coalescer.coalesce(response_generator, counts=stream_counts))
 
         if full_response:
-             st.session_state.chat_history.append({"role": "model", "content": full_response})
+             prompt_tokens = prompt_context.tokens + context_packer.estimate_tokens(prompt) + 60 # 60: instructions wrapped around the context
+             output_tokens = context_packer.estimate_tokens(full_response)
+             cached_tokens = context_cache.record_use(prefix, stream_usage.get("cached_tokens")) if prefix else 0
+             st.session_state.chat_history.append({"role": "model", "content": full_response, "usage": {
+                 "prompt_tokens": prompt_tokens,
+                 "context_tokens": prompt_context.tokens,
+                 "history_turns": prompt_context.history_turns,
+                 "cached_tokens": cached_tokens,
+                 "output_tokens": output_tokens,
+                 "cost": context_packer.estimate_cost(prompt_tokens, output_tokens, cached_tokens),
+                 "chunks": stream_counts.get("chunks", 0),
+                 "deltas": stream_counts.get("deltas", 0),
+             }})
+             chat_transcripts.append(st.session_state.chat_id, st.session_state.chat_history[-1])
+             chat_memory.schedule_update(st.session_state.chat_memory, st.session_state.model, st.session_state.chat_history)
              st.rerun() # Rerun to update history display
         else:
              st.warning("The AI did not provide a response.", icon="⚠️")
 
 
 # --- Tab 3: Case Law Search (Moved from original Tab 2) ---
-with tab3: # This now holds the Case Law Search content
+@tab_fragment(tab_titles[2])
+def case_law_search_tab(): # This now holds the Case Law Search content
     st.header("🔎 AI Case Law Search")
     st.info("Enter case details. The AI will attempt to find and summarize the case (results stream below).", icon="💡")
 
@@ -442,6 +970,7 @@ with tab3: # This now holds the Case Law Search content
             )
 
         can_search_case = st.session_state.gemini_api_configured and (search_name or search_year)
+        refresh_case = st.checkbox("Force refresh (ignore cached answer)", key="case_force_refresh")
         search_button_clicked = st.button(
             "🔍 Search Cases with AI",
             key="search_case_ai_btn_stream_v4_tab3", # Unique key
@@ -452,23 +981,31 @@ with tab3: # This now holds the Case Law Search content
     st.divider()
 
     if search_button_clicked:
-        prompt = f"Please provide information on the Indian case law titled '{search_name}'"
-        if search_year: prompt += f" from the year {search_year}"
-        else: prompt += " (if year is unknown, provide the most relevant match)"
-        prompt += ". Include a summary, key judgment points, related case with relevant citations and legal interpretations if available."
-
-        with st.spinner("⏳ Asking AI to search for case law..."):
-            st.session_state.case_search_result_stream = get_gemini_response_stream(prompt)
+        prompt = case_law_prompt(search_name, search_year)
+
+        # Answers to the same (normalized) case query are shared by all sessions; see response_cache.py
+        cache_key = response_cache.cache_key("case", [search_name, search_year], st.session_state.model.model_name)
+        cached = None if refresh_case else response_cache.get(cache_key)
+        if cached:
+            st.session_state.case_search_result_stream = response_cache.replay_stream(cached["text"])
+            st.session_state.case_search_cached_at = cached["created_at"]
+        else:
+            with st.spinner("⏳ Asking AI to search for case law..."):
+                st.session_state.case_search_result_stream = get_gemini_response_stream(prompt, kind="case", cache_key=cache_key)
+            st.session_state.case_search_cached_at = None
 
     if st.session_state.case_search_result_stream:
         st.subheader("💬 AI Search Result:")
+        if st.session_state.case_search_cached_at:
+            st.caption(f"⚡ Cached answer from {time.strftime('%Y-%m-%d %H:%M', time.localtime(st.session_state.case_search_cached_at))}. Tick 'Force refresh' to ask the AI again.")
         with st.container(border=True):
-             st.write_stream(st.session_state.case_search_result_stream)
+             st.write_stream(stream_coalescer.coalesce(st.session_state.case_search_result_stream))
         st.session_state.case_search_result_stream = None
 
 
 # --- Tab 4: Legal Provision Lookup (Moved from original Tab 3) ---
-with tab4: # This now holds the Legal Provision Lookup content
+@tab_fragment(tab_titles[3])
+def legal_provisions_tab(): # This now holds the Legal Provision Lookup content
     st.header("📜Legal Provision Lookup")
     st.info("Enter a section number or keyword (e.g., 'Section 80C Income Tax Act'). The AI will try to explain it.", icon="💡")
 
@@ -480,6 +1017,7 @@ with tab4: # This now holds the Legal Provision Lookup content
             )
 
         can_search_prov = st.session_state.gemini_api_configured and search_term
+        refresh_provision = st.checkbox("Force refresh (ignore cached answer)", key="provision_force_refresh")
         search_prov_button_clicked = st.button(
             "📜 Search Provisions with AI",
             key="search_prov_ai_btn_stream_v4_tab4", # Unique key
@@ -490,53 +1028,87 @@ with tab4: # This now holds the Legal Provision Lookup content
     st.divider()
 
     if search_prov_button_clicked:
-        prompt = f"""Regarding the legal provision for '{search_term}' under Indian law:
-
-    Provide the following information formatted clearly using Markdown, suitable for direct use in Notion notes. Do *not* include any conversational text, introductory phrases, or concluding remarks. Output *only* the structured information requested below:
-
-    ### **Act and Section:**
-    [Specify the full Act name and relevant Section number(s) here]
-
-    ### **Detailed Notes:**
-    [Provide a detailed notes of the legal provision.]
-
-    ### **Key Aspects:**
-    * [Explain the first key aspect or element]
-    * [Explain the second key aspect or element]
-    * [Add more bullet points as necessary for other key aspects]
+        prompt = provision_prompt(search_term)
 
-    ### **Relevant Case Laws:**
-    * [Relevant case law number 1 with a brief summary note]
-    * [Relevant case law number 2 with a brief summary note]
-    * [Add more bullet points as necessary for other relevant case laws]
-    """
-
-        with st.spinner("⏳ Asking AI to search for provision..."):
-            st.session_state.provision_search_result_stream = get_gemini_response_stream(prompt)
+        cache_key = response_cache.cache_key("provision", [search_term], st.session_state.model.model_name)
+        cached = None if refresh_provision else response_cache.get(cache_key)
+        if cached:
+            st.session_state.provision_search_result_stream = response_cache.replay_stream(cached["text"])
+            st.session_state.provision_search_cached_at = cached["created_at"]
+        else:
+            with st.spinner("⏳ Asking AI to search for provision..."):
+                st.session_state.provision_search_result_stream = get_gemini_response_stream(prompt, kind="provision", cache_key=cache_key)
+            st.session_state.provision_search_cached_at = None
 
     if st.session_state.provision_search_result_stream:
         st.subheader("💬 AI Search Result:")
+        if st.session_state.provision_search_cached_at:
+            st.caption(f"⚡ Cached answer from {time.strftime('%Y-%m-%d %H:%M', time.localtime(st.session_state.provision_search_cached_at))}. Tick 'Force refresh' to ask the AI again.")
         with st.container(border=True):
-            st.write_stream(st.session_state.provision_search_result_stream)
+            st.write_stream(stream_coalescer.coalesce(st.session_state.provision_search_result_stream))
         st.session_state.provision_search_result_stream = None
 
+    st.divider()
+    with st.expander("📋 Batch Lookup (many provisions at once)", expanded=st.session_state.provision_batch_id is not None):
+        st.caption("Paste one section per line and/or upload a CSV (a 'section' column, or the first column is used). Results appear as each lookup completes.")
+        batch_text = st.text_area("Sections", key="provision_batch_text", height=150, placeholder="Section 80C Income Tax Act\nSection 10(1) IT Act\nSection 302 IPC")
+        batch_csv = st.file_uploader("Or upload a CSV", type=["csv"], key="provision_batch_csv")
+        col1_batch, col2_batch = st.columns(2)
+        with col1_batch:
+            batch_concurrency = st.slider("Parallel requests", min_value=1, max_value=16, value=batch_lookup.BATCH_CONCURRENCY, key="provision_batch_concurrency")
+        with col2_batch:
+            batch_refresh = st.checkbox("Force refresh (ignore cached answers)", key="provision_batch_refresh")
+        batch_terms = batch_lookup.parse_terms(batch_text, batch_csv.getvalue() if batch_csv else None)
+        running_batch = batch_lookup.get_batch(st.session_state.provision_batch_id) if st.session_state.provision_batch_id else None
+        if len(batch_terms) > batch_lookup.MAX_BATCH_ITEMS:
+            st.warning(f"Only the first {batch_lookup.MAX_BATCH_ITEMS} of {len(batch_terms)} sections will be looked up.", icon="⚠️")
+        if st.button(
+            f"📜 Look Up {len(batch_terms)} Provision(s)",
+            key="provision_batch_start",
+            disabled=not (st.session_state.gemini_api_configured and batch_terms) or (running_batch is not None and not running_batch.finished),
+            use_container_width=True
+        ):
+            if st.session_state.provision_batch_id:
+                batch_lookup.forget(st.session_state.provision_batch_id)
+            st.session_state.provision_batch_id = batch_lookup.start_batch(batch_terms, st.session_state.model, batch_concurrency, batch_refresh)
+
+        if running_batch is None and st.session_state.provision_batch_id:
+            running_batch = batch_lookup.get_batch(st.session_state.provision_batch_id) # Just started
+        if running_batch is None:
+            st.session_state.provision_batch_id = None
+        elif running_batch.finished:
+            show_provision_batch(running_batch)
+        else:
+            render_provision_batch()
+
 
 # --- Tab 5: Document Comparison ---
-with tab5:
+@tab_fragment(tab_titles[4])
+def document_comparison_tab():
+    document_comparison = startup_profile.import_module("document_comparison")
     st.header("📊 Document Comparison")
     st.info("Compare two legal documents and see the differences highlighted.", icon="💡")
     
-    # File upload section
+    # File upload section; documents already loaded for context can be picked instead of uploaded again
+    loaded_names = list(st.session_state.loaded_documents.keys())
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("Document 1")
-        file1 = st.file_uploader("Upload first document", key="doc_compare_file1", 
-                               type=["txt", "pdf", "docx"], help="Upload the first document for comparison")
+        source1 = st.radio("Source", ["Upload", "Loaded documents"], horizontal=True, key="doc_compare_source1", disabled=not loaded_names)
+        if source1 == "Upload":
+            file1 = st.file_uploader("Upload first document", key="doc_compare_file1", 
+                                   type=["txt", "pdf", "docx"], help="Upload the first document for comparison")
+        else:
+            file1 = st.selectbox("Choose first document", loaded_names, key="doc_compare_stored1")
     
     with col2:
         st.subheader("Document 2")
-        file2 = st.file_uploader("Upload second document", key="doc_compare_file2", 
-                               type=["txt", "pdf", "docx"], help="Upload the second document for comparison")
+        source2 = st.radio("Source", ["Upload", "Loaded documents"], horizontal=True, key="doc_compare_source2", disabled=not loaded_names)
+        if source2 == "Upload":
+            file2 = st.file_uploader("Upload second document", key="doc_compare_file2", 
+                                   type=["txt", "pdf", "docx"], help="Upload the second document for comparison")
+        else:
+            file2 = st.selectbox("Choose second document", loaded_names, key="doc_compare_stored2")
     
     # Comparison options
     comparison_type = st.radio(
@@ -557,15 +1129,19 @@ with tab5:
     # Perform comparison when button is clicked
     if compare_button and file1 and file2:
         with st.spinner("Comparing documents..."):
-            # Extract text from uploaded files
-            text1 = extract_text_from_uploaded_file(file1)
-            text2 = extract_text_from_uploaded_file(file2)
+            # Extract text from uploaded files, or read loaded documents from the store
+            def comparison_text(file):
+                if isinstance(file, str):
+                    return document_store.get_text(st.session_state.loaded_documents[file]) or f"Error extracting text: {file} is no longer stored"
+                return document_comparison.extract_text_from_uploaded_file(file)
+            text1 = comparison_text(file1)
+            text2 = comparison_text(file2)
             
             # Determine comparison type
             comp_type = "line" if comparison_type == "Line by Line" else "word"
             
             # Compare documents
-            comparison_result = compare_documents(text1, text2, comp_type)
+            comparison_result = document_comparison.compare_documents(text1, text2, comp_type)
             
             # Display results
             st.subheader("Comparison Results")
@@ -573,15 +1149,35 @@ with tab5:
 
 
 # --- Tab 6: Citation Generator ---
-with tab6:
-    citation_generator_tab()
+@tab_fragment(tab_titles[5])
+def citation_generator_page():
+    startup_profile.import_module("citation_generator").citation_generator_tab()
 
 
 # --- Tab 7: Deadline Tracker ---
-with tab7:
-    deadline_tracker_tab()
+@tab_fragment(tab_titles[6])
+def deadline_tracker_page():
+    startup_profile.import_module("deadline_tracker").deadline_tracker_tab()
 
 
 # --- Tab 8: Advanced Search ---
-with tab8:
-    advanced_search_tab()
\ No newline at end of file
+@tab_fragment(tab_titles[7])
+def advanced_search_page():
+    startup_profile.import_module("advanced_search").advanced_search_tab()
+
+
+# --- Render the Selected Tab ---
+tab_bodies = dict(zip(tab_titles, [
+    upload_files_tab, general_chat_tab, case_law_search_tab, legal_provisions_tab,
+    document_comparison_tab, citation_generator_page, deadline_tracker_page, advanced_search_page,
+]))
+tab_bodies[active_tab]()
+if st.session_state.gemini_api_configured:
+    st.session_state.model.start() # The page is painted; create and warm up the backend now
+
+
+# --- Startup Report ---
+# Reruns that end in st.rerun()/st.stop() never get here and are not counted
+_script_seconds = time.perf_counter() - _script_started
+startup_profile.record_cold_start("First script run", _script_seconds)
+startup_profile.record_run(active_tab, _script_seconds)
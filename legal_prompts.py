@@ -0,0 +1,35 @@
+# --- Legal Prompts ---
+# Prompt builders shared by the interactive tabs and batch lookups, so the
+# same query always produces the same prompt (and the same cached answer).
+
+def case_law_prompt(search_name, search_year=""):
+    """Builds the Case Law Search prompt."""
+    prompt = f"Please provide information on the Indian case law titled '{search_name}'"
+    if search_year: prompt += f" from the year {search_year}"
+    else: prompt += " (if year is unknown, provide the most relevant match)"
+    prompt += ". Include a summary, key judgment points, related case with relevant citations and legal interpretations if available."
+    return prompt
+
+
+def provision_prompt(search_term):
+    """Builds the Legal Provision Lookup prompt, formatted for Markdown/Notion notes."""
+    return f"""Regarding the legal provision for '{search_term}' under Indian law:
+
+    Provide the following information formatted clearly using Markdown, suitable for direct use in Notion notes. Do *not* include any conversational text, introductory phrases, or concluding remarks. Output *only* the structured information requested below:
+
+    ### **Act and Section:**
+    [Specify the full Act name and relevant Section number(s) here]
+
+    ### **Detailed Notes:**
+    [Provide a detailed notes of the legal provision.]
+
+    ### **Key Aspects:**
+    * [Explain the first key aspect or element]
+    * [Explain the second key aspect or element]
+    * [Add more bullet points as necessary for other key aspects]
+
+    ### **Relevant Case Laws:**
+    * [Relevant case law number 1 with a brief summary note]
+    * [Relevant case law number 2 with a brief summary note]
+    * [Add more bullet points as necessary for other relevant case laws]
+    """
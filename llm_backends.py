@@ -0,0 +1,454 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import llm_pool
+import llm_resilience
+import startup_profile
+
+# --- LLM Backends ---
+# Every tab talks to the model through a backend object with the same
+# interface as a Gemini GenerativeModel (model_name, generate_content and
+# generate_content_async, returning chunks with .parts and .text), so the app
+# can run against:
+#   gemini - the Gemini API (needs an API key and network)
+#   local  - an offline stand-in that streams synthetic answers with a
+#            configurable token rate, time to first token and error rate
+#   replay - answers recorded earlier with LLM_RECORD_PATH, replayed with
+#            their original timing
+# Setting LLM_RECORD_PATH records every request of the chosen backend to a
+# JSONL file, so a captured session can be replayed offline and reproducibly.
+# google-generativeai is only imported when a Gemini backend is created; the
+# app creates it with a DeferredBackend, after the first paint.
+
+BACKEND = os.environ.get("LLM_BACKEND", "gemini")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-pro-preview-03-25")
+RECORD_PATH = os.environ.get("LLM_RECORD_PATH")
+REPLAY_PATH = os.environ.get("LLM_REPLAY_PATH")
+REPLAY_SPEED = float(os.environ.get("LLM_REPLAY_SPEED", "1.0"))  # 2.0 replays twice as fast
+
+LOCAL_TOKENS_PER_SECOND = float(os.environ.get("LOCAL_LLM_TOKENS_PER_SECOND", "60"))
+LOCAL_TTFT_SECONDS = float(os.environ.get("LOCAL_LLM_TTFT_SECONDS", "0.8"))
+LOCAL_OUTPUT_TOKENS = int(os.environ.get("LOCAL_LLM_OUTPUT_TOKENS", "300"))
+LOCAL_ERROR_RATE = float(os.environ.get("LOCAL_LLM_ERROR_RATE", "0"))  # Share of requests that fail
+LOCAL_TOKENS_PER_CHUNK = 8
+
+
+class BackendError(Exception):
+    """Raised by stand-in backends for injected errors and prompts missing from a recording."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable  # Injected errors stand in for transient upstream failures
+
+
+@dataclass
+class UsageMetadata:
+    """Token counts reported with the last chunk, like Gemini's usage_metadata."""
+    prompt_token_count: int = 0
+    candidates_token_count: int = 0
+    cached_content_token_count: int = 0
+
+
+class Chunk:
+    """A streamed piece of an answer, shaped like a Gemini response chunk."""
+
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.parts = [text] if text else []
+        self.usage_metadata = usage_metadata
+
+
+def prompt_hash(contents):
+    """Identifies a request in recordings."""
+    return hashlib.sha256(str(contents).encode("utf-8")).hexdigest()
+
+
+def _estimate_tokens(text):
+    return max(1, len(str(text)) // 4)
+
+
+class GeminiBackend:
+    """The Gemini API."""
+
+    name = "gemini"
+    supports_context_cache = True
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL, model=None):
+        try:
+            genai = startup_profile.import_module("google.generativeai")
+        except ImportError:
+            raise ImportError("google-generativeai is not installed (`pip install google-generativeai`)")
+        if api_key:
+            genai.configure(api_key=api_key)
+        self._model = model or genai.GenerativeModel(model_name)
+        self.model_name = self._model.model_name
+
+    def warm_up(self):
+        """Opens the connection to the API with a cheap request, so the first answer does not pay for it."""
+        self._model.count_tokens("warm-up")
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        return self._model.generate_content(contents, stream=stream, **kwargs)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        return await self._model.generate_content_async(contents, stream=stream, **kwargs)
+
+    def create_cached_content(self, contents, ttl_seconds, display_name=None):
+        """Registers contents with Gemini's context caching and returns the CachedContent."""
+        genai_caching = startup_profile.import_module("google.generativeai.caching")
+        return genai_caching.CachedContent.create(
+            model=self.model_name,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+            display_name=display_name,
+        )
+
+    def from_cached_content(self, cached_content):
+        """Returns a backend whose requests start with the cached contents."""
+        genai = startup_profile.import_module("google.generativeai")
+        return GeminiBackend(None, model=genai.GenerativeModel.from_cached_content(cached_content=cached_content))
+
+
+class LocalBackend:
+    """Offline stand-in that streams a synthetic answer with configurable latency and errors."""
+
+    name = "local"
+    supports_context_cache = False
+
+    def __init__(self, tokens_per_second=LOCAL_TOKENS_PER_SECOND, ttft_seconds=LOCAL_TTFT_SECONDS,
+                 output_tokens=LOCAL_OUTPUT_TOKENS, error_rate=LOCAL_ERROR_RATE, seed=None):
+        self.model_name = "local-stand-in"
+        self.tokens_per_second = tokens_per_second
+        self.ttft_seconds = ttft_seconds
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def warm_up(self):
+        pass
+
+    def _plan(self, contents):
+        """Returns the chunks of the answer to contents and the index of the chunk to fail at, if any."""
+        with self._random_lock:
+            fail_at = self._random.randrange(-1, self.output_tokens // LOCAL_TOKENS_PER_CHUNK) if self._random.random() < self.error_rate else None
+        first_line = str(contents).strip().splitlines()[0][:120] if str(contents).strip() else ""
+        words = [f"**Stand-in answer** to: _{first_line}_\n\n"]
+        filler = "The provision applies subject to the conditions laid down in the Act and the rules made thereunder".split()
+        for i in range(self.output_tokens):
+            words.append(filler[i % len(filler)] + (".\n\n" if i % 40 == 39 else " "))
+        chunks = ["".join(words[i:i + LOCAL_TOKENS_PER_CHUNK]) for i in range(0, len(words), LOCAL_TOKENS_PER_CHUNK)]
+        usage = UsageMetadata(prompt_token_count=_estimate_tokens(contents), candidates_token_count=self.output_tokens)
+        return chunks, fail_at, usage
+
+    def _delays(self, chunks):
+        yield self.ttft_seconds
+        for _ in chunks[1:]:
+            yield LOCAL_TOKENS_PER_CHUNK / self.tokens_per_second
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        chunks, fail_at, usage = self._plan(contents)
+
+        def stream_chunks():
+            for i, (chunk, delay) in enumerate(zip(chunks, self._delays(chunks))):
+                time.sleep(delay)
+                if i == fail_at or fail_at == -1:
+                    raise BackendError("Injected stand-in error (LOCAL_LLM_ERROR_RATE)", retryable=True)
+                yield Chunk(chunk, usage if i == len(chunks) - 1 else None)
+        return stream_chunks() if stream else _Response(list(stream_chunks()))
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        chunks, fail_at, usage = self._plan(contents)
+
+        async def stream_chunks():
+            for i, (chunk, delay) in enumerate(zip(chunks, self._delays(chunks))):
+                await asyncio.sleep(delay)
+                if i == fail_at or fail_at == -1:
+                    raise BackendError("Injected stand-in error (LOCAL_LLM_ERROR_RATE)", retryable=True)
+                yield Chunk(chunk, usage if i == len(chunks) - 1 else None)
+        if stream:
+            return stream_chunks()
+        return _Response([chunk async for chunk in stream_chunks()])
+
+
+class _Response:
+    """Non-streamed answer of a stand-in backend."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.text = "".join(chunk.text for chunk in chunks)
+        self.parts = [self.text] if self.text else []
+        self.usage_metadata = chunks[-1].usage_metadata if chunks else None
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class RecordingBackend:
+    """Wraps a backend and appends every request to a JSONL recording.
+
+    A non-streamed answer is recorded as a single chunk.
+    """
+
+    supports_context_cache = False  # Cached prefixes would not be in the recording
+
+    def __init__(self, backend, path):
+        self._backend = backend
+        self.name = f"{backend.name}+record"
+        self.model_name = backend.model_name
+        self.path = path
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        self._backend.warm_up()
+
+    def _write(self, contents, started, chunks, error):
+        record = {
+            "prompt_hash": prompt_hash(contents),
+            "prompt_preview": str(contents)[:200],
+            "model": self.model_name,
+            "recorded_at": started,
+            "chunks": chunks,  # [seconds since the request was sent, text]
+            "error": error,
+        }
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _write_response(self, contents, started, response):
+        """Records a non-streamed answer and returns it."""
+        text = response.text if response.parts else ""
+        self._write(contents, started, [[time.time() - started, text]] if text else [], None)
+        return response
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        started = time.time()
+        if not stream:
+            try:
+                response = self._backend.generate_content(contents, **kwargs)
+            except Exception as e:
+                self._write(contents, started, [], str(e))
+                raise
+            return self._write_response(contents, started, response)
+        response = self._backend.generate_content(contents, stream=True, **kwargs)
+
+        def record_chunks():
+            chunks, error = [], None
+            try:
+                for chunk in response:
+                    if chunk.parts:
+                        chunks.append([time.time() - started, chunk.text])
+                    yield chunk
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                self._write(contents, started, chunks, error)
+        return record_chunks()
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        started = time.time()
+        if not stream:
+            try:
+                response = await self._backend.generate_content_async(contents, **kwargs)
+            except Exception as e:
+                self._write(contents, started, [], str(e))
+                raise
+            return self._write_response(contents, started, response)
+        response = await self._backend.generate_content_async(contents, stream=True, **kwargs)
+
+        async def record_chunks():
+            chunks, error = [], None
+            try:
+                async for chunk in response:
+                    if chunk.parts:
+                        chunks.append([time.time() - started, chunk.text])
+                    yield chunk
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                self._write(contents, started, chunks, error)
+        return record_chunks()
+
+
+class ReplayBackend:
+    """Replays answers from a JSONL recording with their recorded timing.
+
+    Requests are matched by prompt; repeated prompts replay their recordings in order.
+    """
+
+    name = "replay"
+    supports_context_cache = False
+
+    def __init__(self, path, speed=REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+        self.model_name = "replay"
+        self._recordings = {}  # prompt hash -> list of records
+        self._next = {}  # prompt hash -> index of the next record to replay
+        self._lock = threading.Lock()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._recordings.setdefault(record["prompt_hash"], []).append(record)
+                    self.model_name = record.get("model", self.model_name)
+
+    def _record_for(self, contents):
+        key = prompt_hash(contents)
+        with self._lock:
+            records = self._recordings.get(key)
+            if not records:
+                raise BackendError(f"Prompt not in recording {self.path}: {str(contents)[:80]!r}")
+            index = self._next.get(key, 0)
+            self._next[key] = index + 1
+            return records[index % len(records)]
+
+    def warm_up(self):
+        pass
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        record = self._record_for(contents)
+
+        def replay_chunks():
+            started = time.time()
+            for offset, text in record["chunks"]:
+                time.sleep(max(0.0, offset / self.speed - (time.time() - started)))
+                yield Chunk(text)
+            if record.get("error"):
+                raise BackendError(record["error"], retryable=True)
+        return replay_chunks() if stream else _Response(list(replay_chunks()))
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        record = self._record_for(contents)
+
+        async def replay_chunks():
+            started = time.time()
+            for offset, text in record["chunks"]:
+                await asyncio.sleep(max(0.0, offset / self.speed - (time.time() - started)))
+                yield Chunk(text)
+            if record.get("error"):
+                raise BackendError(record["error"], retryable=True)
+        if stream:
+            return replay_chunks()
+        return _Response([chunk async for chunk in replay_chunks()])
+
+
+def create_backend(api_key=None, backend=BACKEND):
+    """Creates the backend selected by LLM_BACKEND, wrapped for recording if LLM_RECORD_PATH is set.
+
+    The backend is wrapped in an llm_pool.PooledBackend (bounded request slots) and that in
+    llm_resilience.ResilientBackend (rate limit, retries, circuit breaker), so retries wait
+    outside the pool; recordings hold the raw upstream answers and errors, retries included.
+    The result is meant to be created once per process and shared by all sessions.
+
+    api_key is only needed for the gemini backend.
+    """
+    if backend == "local":
+        model = LocalBackend()
+    elif backend == "replay":
+        if not REPLAY_PATH:
+            raise ValueError("LLM_REPLAY_PATH must point to a recording for LLM_BACKEND=replay")
+        model = ReplayBackend(REPLAY_PATH)
+    elif backend == "gemini":
+        model = GeminiBackend(api_key)
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+    if RECORD_PATH:
+        model = RecordingBackend(model, RECORD_PATH)
+    return llm_resilience.ResilientBackend(llm_pool.PooledBackend(model))
+
+
+class DeferredBackend:
+    """Creates a backend with create_backend on a daemon thread and warms it up.
+
+    Creating it imports the client library, so the app starts it once the page has been
+    painted (start) or on first use; requests made earlier wait until it is ready.
+    """
+
+    def __init__(self, api_key=None, backend=BACKEND):
+        self._api_key = api_key
+        self._kind = backend
+        self._backend = None
+        self.error = None  # Why the backend could not be created
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts creating the backend in the background, unless already started."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._create, name="llm-setup", daemon=True).start()
+
+    def _create(self):
+        started = time.perf_counter()
+        try:
+            self._backend = create_backend(self._api_key, self._kind)
+        except Exception as e:
+            self.error = e
+        startup_profile.record_cold_start("LLM backend setup", time.perf_counter() - started)
+        self._ready.set()
+        if self._backend is None:
+            return
+        started = time.perf_counter()
+        try:
+            self._backend.warm_up()  # Connect before the first question instead of during it
+            phase = "LLM warm-up"
+        except Exception:
+            phase = "LLM warm-up (failed)"  # The first real request will connect instead
+        startup_profile.record_cold_start(phase, time.perf_counter() - started)
+
+    @property
+    def ready(self):
+        """Whether creating the backend has finished, successfully or not."""
+        return self._ready.is_set()
+
+    def _get(self):
+        self.start()
+        self._ready.wait()
+        if self._backend is None:
+            raise BackendError(f"The LLM backend could not be created: {self.error}")
+        return self._backend
+
+    @property
+    def name(self):
+        return self._backend.name if self._backend is not None else self._kind
+
+    @property
+    def model_name(self):
+        return self._get().model_name
+
+    @property
+    def supports_context_cache(self):
+        self.start()
+        self._ready.wait()
+        return getattr(self._backend, "supports_context_cache", False)
+
+    def warm_up(self):
+        self._get().warm_up()
+
+    def pool_stats(self):
+        return self._get().pool_stats()
+
+    def create_cached_content(self, *args, **kwargs):
+        return self._get().create_cached_content(*args, **kwargs)
+
+    def from_cached_content(self, cached_content):
+        return self._get().from_cached_content(cached_content)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        return self._get().generate_content(contents, stream=stream, **kwargs)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        await asyncio.to_thread(self._ready.wait)
+        return await self._get().generate_content_async(contents, stream=stream, **kwargs)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+import time
+
+# --- Shared LLM Client Pool ---
+# One backend per process is shared by every session and tab (the app keeps it
+# in st.cache_resource), so the client, its HTTP/gRPC connections and its
+# configuration are set up once and reused by all streaming requests. The pool
+# hands out POOL_SIZE request slots: a request holds a slot from sending the
+# prompt until its stream is fully read, and waits for a free slot when all
+# are busy. Slot usage is measured so the sidebar can show how close the
+# process is to its concurrency limit.
+
+POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "16"))  # Concurrent requests per process
+
+
+class _Slots:
+    """Request slots and their utilization counters, shared by a pool and its derived models."""
+
+    def __init__(self, size):
+        self.size = size
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.peak = 0
+        self.requests = 0
+        self.waited = 0  # Requests that found every slot busy
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0  # Sum over requests of the time a slot was held
+        self.started = time.time()
+
+    def _acquired(self, wait_started, had_to_wait):
+        with self._lock:
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+            self.requests += 1
+            if had_to_wait:
+                self.waited += 1
+                self.wait_seconds += time.perf_counter() - wait_started
+        return time.perf_counter()
+
+    def acquire(self):
+        """Blocks until a slot is free; returns the time it was taken."""
+        wait_started = time.perf_counter()
+        had_to_wait = not self._semaphore.acquire(blocking=False)
+        if had_to_wait:
+            self._semaphore.acquire()
+        return self._acquired(wait_started, had_to_wait)
+
+    async def acquire_async(self):
+        """Waits for a free slot without blocking the event loop; returns the time it was taken."""
+        wait_started = time.perf_counter()
+        had_to_wait = False
+        while not self._semaphore.acquire(blocking=False):
+            had_to_wait = True
+            await asyncio.sleep(0.02)
+        return self._acquired(wait_started, had_to_wait)
+
+    def release(self, taken_at):
+        with self._lock:
+            self.in_use -= 1
+            self.busy_seconds += time.perf_counter() - taken_at
+        self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "peak": self.peak,
+                "requests": self.requests,
+                "waited": self.waited,
+                "avg_wait_seconds": self.wait_seconds / self.waited if self.waited else 0.0,
+                "utilization": self.busy_seconds / (self.size * elapsed),
+            }
+
+
+class PooledBackend:
+    """Wraps a backend (see llm_backends.py) so every request runs in one of a bounded set of slots."""
+
+    def __init__(self, backend, size=POOL_SIZE, slots=None):
+        self._backend = backend
+        self._slots = slots or _Slots(size)
+        self.name = backend.name
+        self.model_name = backend.model_name
+        self.supports_context_cache = getattr(backend, "supports_context_cache", False)
+
+    def warm_up(self):
+        self._backend.warm_up()
+
+    def create_cached_content(self, *args, **kwargs):
+        return self._backend.create_cached_content(*args, **kwargs)
+
+    def from_cached_content(self, cached_content):
+        # Shares this pool's slots: it is the same client, only with a cached prefix
+        return PooledBackend(self._backend.from_cached_content(cached_content), slots=self._slots)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        if stream:
+            return self._stream(contents, **kwargs)
+        taken_at = self._slots.acquire()
+        try:
+            return self._backend.generate_content(contents, **kwargs)
+        finally:
+            self._slots.release(taken_at)
+
+    def _stream(self, contents, **kwargs):
+        taken_at = self._slots.acquire()
+        try:
+            yield from self._backend.generate_content(contents, stream=True, **kwargs)
+        finally:
+            self._slots.release(taken_at)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        if stream:
+            return self._stream_async(contents, **kwargs)
+        taken_at = await self._slots.acquire_async()
+        try:
+            return await self._backend.generate_content_async(contents, **kwargs)
+        finally:
+            self._slots.release(taken_at)
+
+    async def _stream_async(self, contents, **kwargs):
+        taken_at = await self._slots.acquire_async()
+        try:
+            async for chunk in await self._backend.generate_content_async(contents, stream=True, **kwargs):
+                yield chunk
+        finally:
+            self._slots.release(taken_at)
+
+    def pool_stats(self):
+        """Returns slot counts, waits and utilization (share of slot time in use) since startup."""
+        return self._slots.stats()
@@ -0,0 +1,307 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+# --- LLM Call Resilience ---
+# Every LLM backend is wrapped in a ResilientBackend that protects the upstream
+# when many sessions call it at once:
+#   - a token bucket shared by all sessions of the process limits the request
+#     rate (requests wait for a token, up to a maximum queueing time);
+#   - retryable errors (quota, overload, timeouts) are retried with jittered
+#     exponential backoff; a stream that fails after part of the answer has
+#     arrived is resumed by asking the model to continue where it stopped;
+#   - a circuit breaker opens after repeated failures and fast-fails requests
+#     until a cool-down has passed, then lets one probe request through.
+# Users therefore see a clear "unavailable" status instead of retrying by hand
+# and amplifying the overload.
+
+RATE_PER_MINUTE = float(os.environ.get("LLM_RATE_PER_MINUTE", "60"))
+BURST = int(os.environ.get("LLM_BURST", "10"))
+MAX_QUEUE_SECONDS = float(os.environ.get("LLM_MAX_QUEUE_SECONDS", "30"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", "1.0"))
+BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", "20"))
+BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))  # Consecutive failures that open the circuit
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# HTTP status codes and google.api_core exception names worth retrying
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+                   "InternalServerError", "GatewayTimeout", "Aborted", "RetryError"}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+RESUME_PROMPT = ("{prompt}\n\n--- PARTIAL ANSWER ---\n{partial}\n--- END OF PARTIAL ANSWER ---\n"
+                 "Your previous answer to this request was cut off at the end of the partial answer above. "
+                 "Continue it exactly where it stopped, without repeating any of it.")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while the circuit breaker is open."""
+
+
+class RateLimitedError(Exception):
+    """Raised when no request slot became free within MAX_QUEUE_SECONDS."""
+
+
+def is_retryable(error):
+    """Whether an error is transient (quota, overload, timeout) and worth retrying."""
+    if isinstance(error, (CircuitOpenError, RateLimitedError)):
+        return False
+    if getattr(error, "retryable", False):
+        return True
+    if type(error).__name__ in RETRYABLE_NAMES or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    code = getattr(code, "value", code)  # grpc status enums
+    return code in RETRYABLE_CODES
+
+
+def backoff_delay(attempt):
+    """Seconds to wait before retry number attempt (0-based): full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, holding at most capacity."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Takes a token and returns how many seconds the caller must wait before using it."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def cancel(self):
+        """Returns a reserved token the caller did not use."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    @property
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, fast-fails while open, and probes after a cool-down."""
+
+    def __init__(self, failure_threshold, cooldown_seconds):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError unless a request may be sent now."""
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.cooldown_seconds:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_in = max(0.0, self.opened_at + self.cooldown_seconds - time.time())
+            raise CircuitOpenError(
+                f"The AI service is temporarily unavailable after repeated errors; "
+                f"new requests are paused for {retry_in:.0f}s. Last error: {self.last_error}"
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+            self._probe_in_flight = False
+
+    def record_ignored(self):
+        """A call ended with an error that says nothing about upstream health."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+_limiter = TokenBucket(RATE_PER_MINUTE / 60.0, BURST)
+_breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN_SECONDS)
+_stats = {"requests": 0, "retries": 0, "resumed": 0, "rate_limited": 0, "fast_failed": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _admit_wait():
+    """Checks the breaker and reserves a rate-limit token; returns the seconds to wait."""
+    try:
+        _breaker.before_call()
+    except CircuitOpenError:
+        _count("fast_failed")
+        raise
+    wait = _limiter.reserve()
+    if wait > MAX_QUEUE_SECONDS:
+        _limiter.cancel()
+        _breaker.record_ignored()
+        _count("rate_limited")
+        raise RateLimitedError(f"Too many AI requests right now; please try again in {wait:.0f}s.")
+    _count("requests")
+    return wait
+
+
+def _failed(error, attempt):
+    """Records a failed attempt and returns whether it should be retried."""
+    if is_retryable(error):
+        _breaker.record_failure(error)
+        if attempt < MAX_RETRIES and _breaker.state != OPEN:
+            _count("retries")
+            return True
+    else:
+        _breaker.record_ignored()
+    _count("failed")
+    return False
+
+
+class ResilientBackend:
+    """Wraps an LLM backend (see llm_backends.py) with rate limiting, retries and a circuit breaker."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.name = backend.name
+        self.model_name = backend.model_name
+        self.supports_context_cache = getattr(backend, "supports_context_cache", False)
+
+    def warm_up(self):
+        self._backend.warm_up()
+
+    def pool_stats(self):
+        return self._backend.pool_stats()
+
+    def create_cached_content(self, *args, **kwargs):
+        return self._backend.create_cached_content(*args, **kwargs)
+
+    def from_cached_content(self, cached_content):
+        return ResilientBackend(self._backend.from_cached_content(cached_content))
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        if stream:
+            return self._stream(contents, **kwargs)
+        for attempt in range(MAX_RETRIES + 1):
+            time.sleep(_admit_wait())
+            try:
+                response = self._backend.generate_content(contents, **kwargs)
+            except Exception as e:
+                if not _failed(e, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            _breaker.record_success()
+            return response
+
+    def _stream(self, contents, **kwargs):
+        partial = []
+        for attempt in range(MAX_RETRIES + 1):
+            time.sleep(_admit_wait())
+            request = RESUME_PROMPT.format(prompt=contents, partial="".join(partial)) if partial else contents
+            if partial:
+                _count("resumed")
+            try:
+                for chunk in self._backend.generate_content(request, stream=True, **kwargs):
+                    if chunk.parts:
+                        partial.append(chunk.text)
+                    yield chunk
+            except GeneratorExit:  # The reader stopped early
+                _breaker.record_ignored()
+                raise
+            except Exception as e:
+                if not _failed(e, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            _breaker.record_success()
+            return
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        if stream:
+            return self._stream_async(contents, **kwargs)
+        for attempt in range(MAX_RETRIES + 1):
+            await asyncio.sleep(_admit_wait())
+            try:
+                response = await self._backend.generate_content_async(contents, **kwargs)
+            except Exception as e:
+                if not _failed(e, attempt):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            _breaker.record_success()
+            return response
+
+    async def _stream_async(self, contents, **kwargs):
+        partial = []
+        for attempt in range(MAX_RETRIES + 1):
+            await asyncio.sleep(_admit_wait())
+            request = RESUME_PROMPT.format(prompt=contents, partial="".join(partial)) if partial else contents
+            if partial:
+                _count("resumed")
+            try:
+                async for chunk in await self._backend.generate_content_async(request, stream=True, **kwargs):
+                    if chunk.parts:
+                        partial.append(chunk.text)
+                    yield chunk
+            except GeneratorExit:  # The reader stopped early
+                _breaker.record_ignored()
+                raise
+            except Exception as e:
+                if not _failed(e, attempt):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            _breaker.record_success()
+            return
+
+
+def status():
+    """Returns the circuit breaker state, the free request slots and the retry counters."""
+    with _stats_lock:
+        stats = dict(_stats)
+    state = _breaker.state
+    retry_in = None
+    if state == OPEN:
+        retry_in = max(0.0, _breaker.opened_at + _breaker.cooldown_seconds - time.time())
+    return dict(
+        stats,
+        state=state,
+        consecutive_failures=_breaker.consecutive_failures,
+        last_error=_breaker.last_error,
+        retry_in=retry_in,
+        tokens_available=max(0.0, _limiter.available),
+        burst=BURST,
+        rate_per_minute=RATE_PER_MINUTE,
+    )
@@ -0,0 +1,145 @@
+import collections
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+from context_packer import estimate_tokens
+
+# --- LLM Call Telemetry ---
+# Records prompt size, time to first token, output throughput, total duration
+# and outcome (completed, error, or cancelled by the reader) of every LLM call (chat, case search, provision lookups) in a
+# rolling window shared by all sessions of the process. The sidebar shows
+# p50/p95 per kind of call, and the window can be exported as JSON lines for
+# offline analysis. Token counts come from the API's usage metadata when it
+# reports them and are estimated from the text otherwise.
+
+WINDOW = int(os.environ.get("LLM_TELEMETRY_WINDOW", "1000"))  # Most recent calls kept per process
+
+
+@dataclass
+class CallRecord:
+    """Timings and sizes of one LLM call."""
+    kind: str
+    model: str
+    started_at: float  # Unix time the request was sent
+    prompt_chars: int
+    prompt_tokens: int
+    ttft: float = None  # Seconds to the first streamed text
+    duration: float = None  # Seconds to the end of the answer (or the error)
+    output_chars: int = 0
+    output_tokens: int = 0
+    error: str = None
+    cancelled: bool = False  # The reader stopped before the answer completed; not an error
+
+    @property
+    def tokens_per_second(self):
+        """Output tokens per second after the first token, or None if unknown."""
+        if self.ttft is None or self.duration is None or self.duration <= self.ttft:
+            return None
+        return self.output_tokens / (self.duration - self.ttft)
+
+
+class CallTimer:
+    """Measures one LLM call; call first_text() on the first streamed text and finish() at the end."""
+
+    def __init__(self, kind, model_name, prompt):
+        prompt = str(prompt)
+        self.record = CallRecord(kind, model_name, time.time(), len(prompt), estimate_tokens(prompt))
+        self._start = time.perf_counter()
+        self._output = []
+        self._usage = None
+        self._finished = False
+
+    def first_text(self):
+        if self.record.ttft is None:
+            self.record.ttft = time.perf_counter() - self._start
+
+    def add_text(self, text):
+        """Counts a streamed piece of the answer."""
+        self.first_text()
+        self._output.append(text)
+
+    def add_usage(self, usage_metadata):
+        """Keeps the token counts reported by the API, if any."""
+        if usage_metadata is not None:
+            self._usage = usage_metadata
+
+    def finish(self, error=None, output_text=None, cancelled=False):
+        """Completes the record and adds it to the window (only once)."""
+        if self._finished:
+            return
+        self._finished = True
+        output = "".join(self._output) if output_text is None else output_text
+        self.record.duration = time.perf_counter() - self._start
+        self.record.output_chars = len(output)
+        self.record.output_tokens = estimate_tokens(output) if output else 0
+        if self._usage is not None:
+            self.record.prompt_tokens = getattr(self._usage, "prompt_token_count", None) or self.record.prompt_tokens
+            self.record.output_tokens = getattr(self._usage, "candidates_token_count", None) or self.record.output_tokens
+        self.record.error = str(error)[:200] if error is not None else None
+        self.record.cancelled = cancelled
+        add(self.record)
+
+
+_records = collections.deque(maxlen=WINDOW)
+_lock = threading.Lock()
+
+
+def add(record):
+    """Adds a finished call to the rolling window."""
+    with _lock:
+        _records.append(record)
+
+
+def records():
+    """Returns the calls in the window, oldest first."""
+    with _lock:
+        return list(_records)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0-100) of values, or None if there are none."""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summary():
+    """Returns one row per kind of call (and "all") with counts, error rate and p50/p95 metrics.
+
+    Cancelled calls are counted on their own; timings only cover calls that completed.
+    """
+    calls = records()
+    groups = collections.OrderedDict([("all", calls)])
+    for record in calls:
+        groups.setdefault(record.kind, []).append(record)
+    rows = []
+    for kind, group in groups.items():
+        if not group:
+            continue
+        ok = [r for r in group if r.error is None and not r.cancelled]
+        errors = sum(1 for r in group if r.error is not None)
+        cancelled = sum(1 for r in group if r.cancelled)
+        row = {"kind": kind, "calls": len(group), "errors": errors, "error_rate": errors / len(group), "cancelled": cancelled}
+        for name, values in (
+            ("prompt_tokens", [r.prompt_tokens for r in group]),
+            ("ttft", [r.ttft for r in ok]),
+            ("tokens_per_second", [r.tokens_per_second for r in ok]),
+            ("duration", [r.duration for r in ok]),
+        ):
+            row[f"{name}_p50"] = percentile(values, 50)
+            row[f"{name}_p95"] = percentile(values, 95)
+        rows.append(row)
+    return rows
+
+
+def to_jsonl():
+    """Exports the window as JSON lines, one call per line."""
+    return "".join(
+        json.dumps(dict(asdict(record), tokens_per_second=record.tokens_per_second)) + "\n"
+        for record in records()
+    )
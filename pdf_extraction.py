@@ -0,0 +1,138 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from upload_spool import SpooledUpload, open_binary
+
+# --- Page-Sharded PDF Extraction ---
+# Large PDFs are split into contiguous page ranges that are parsed in a process
+# pool, then reassembled in page order. Small PDFs are parsed in-process because
+# starting workers and shipping the bytes to them would cost more than parsing.
+# The same pool also parses whole small files during bulk extraction (see
+# extractors.py); inside a worker, PDFs are always parsed in-process. PyPDF2 is
+# imported by the functions that parse, so modules that only need page_for_offset
+# (retrieval, the context viewer) do not load it.
+
+# PDFs with fewer pages than this are parsed in-process
+PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "40"))
+# Smallest page range handed to a worker; every worker re-reads the PDF cross-reference table
+MIN_PAGES_PER_SHARD = int(os.environ.get("PDF_MIN_PAGES_PER_SHARD", "20"))
+# Largest page range handed to a worker, so progress is reported at least this often
+MAX_PAGES_PER_SHARD = int(os.environ.get("PDF_MAX_PAGES_PER_SHARD", "100"))
+MAX_WORKERS = int(os.environ.get("PDF_MAX_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+_in_worker = False  # Set in pool workers, which must not start pools of their own
+
+
+def _mark_worker():
+    global _in_worker
+    _in_worker = True
+
+
+def _get_pool():
+    """Returns the process pool shared by all sessions, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" avoids forking the multi-threaded Streamlit server process
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_mark_worker,
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _extract_page_range(source, start, end):
+    """Extracts the text of pages [start, end) of a PDF given as a file path or bytes. Runs inside pool workers."""
+    import PyPDF2
+
+    with (open(source, "rb") if isinstance(source, str) else BytesIO(source)) as stream:
+        pdf_reader = PyPDF2.PdfReader(stream)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def page_shards(num_pages, max_workers=None, start_page=0):
+    """Splits pages [start_page, num_pages) into contiguous (start, end) ranges.
+
+    There is at most one range per worker, except that ranges are capped at
+    MAX_PAGES_PER_SHARD pages so that the first pages of a very large PDF are
+    ready early instead of only when a worker finishes a huge range.
+    """
+    max_workers = max_workers or MAX_WORKERS
+    remaining = num_pages - start_page
+    if remaining <= 0:
+        return []
+    shard_count = max(1, min(max_workers, remaining // MIN_PAGES_PER_SHARD))
+    shard_size = min(-(-remaining // shard_count), MAX_PAGES_PER_SHARD)  # Ceiling division
+    return [(start, min(start + shard_size, num_pages)) for start in range(start_page, num_pages, shard_size)]
+
+
+def page_for_offset(page_offsets, offset):
+    """Returns the zero-based page number containing the character at offset."""
+    low, high = 0, len(page_offsets) - 1
+    page = 0
+    while low <= high:
+        mid = (low + high) // 2
+        if page_offsets[mid] <= offset:
+            page = mid
+            low = mid + 1
+        else:
+            high = mid - 1
+    return page
+
+
+def iter_pdf_pages(file_content, start_page=0):
+    """Yields (page_index, page_text, num_pages) for every page from start_page on, in page order.
+
+    file_content is bytes or a SpooledUpload. Pages become available as soon as
+    their range is parsed, so callers can use the beginning of a large PDF while
+    the rest is still being extracted.
+    """
+    import PyPDF2
+
+    with open_binary(file_content) as stream:
+        yield from _iter_pages(PyPDF2.PdfReader(stream), file_content, start_page)
+
+
+def _iter_pages(pdf_reader, file_content, start_page):
+    """Yields pages of an open PdfReader, in-process for small PDFs and through the pool otherwise."""
+    num_pages = len(pdf_reader.pages)
+    if num_pages - start_page < PARALLEL_MIN_PAGES or MAX_WORKERS < 2 or _in_worker:
+        for page_index in range(start_page, num_pages):
+            yield page_index, pdf_reader.pages[page_index].extract_text() or "", num_pages
+        return
+
+    page_index = start_page
+    try:
+        pool = _get_pool()
+        # Workers open a spooled upload by path instead of receiving a pickled copy of the bytes
+        source = file_content.path if isinstance(file_content, SpooledUpload) else bytes(file_content)
+        futures = [pool.submit(_extract_page_range, source, start, end)
+                   for start, end in page_shards(num_pages, start_page=start_page)]
+        try:
+            for future in futures:  # Futures are kept in page order
+                for page_text in future.result():
+                    yield page_index, page_text, num_pages
+                    page_index += 1
+        finally:
+            for future in futures:
+                future.cancel()  # Caller stopped early; don't parse the remaining ranges
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); drop the pool and finish in-process
+        _reset_pool()
+        for page_index in range(page_index, num_pages):
+            yield page_index, pdf_reader.pages[page_index].extract_text() or "", num_pages
@@ -0,0 +1,143 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import context_packer
+import llm_backends
+import research_core
+
+# --- Headless Research Runner ---
+# Runs case law, provision and document-chat queries from a CSV or JSONL file
+# without the UI, e.g. as an overnight batch:
+#
+#   python research_cli.py queries.csv -o results.jsonl --markdown results.md --workers 4
+#
+# Each input row is one query: a "kind" column (case / provision / chat, or
+# --kind for the whole file) plus name/year, term, or question/documents
+# (documents separated by ";"). Results are appended to the output JSONL as
+# they finish, which doubles as the checkpoint: re-running the same command
+# skips queries already answered and retries failed ones. The model comes from
+# llm_backends (LLM_BACKEND, GEMINI_API_KEY), so runs can also be replayed
+# offline.
+
+DEFAULT_WORKERS = int(os.environ.get("RESEARCH_WORKERS", "4"))
+
+_QUERY_FIELDS = {
+    research_core.CASE: ("name", "year"),
+    research_core.PROVISION: ("term",),
+    research_core.CHAT: ("question", "documents"),
+}
+_ALIASES = {"case_name": "name", "section": "term", "provision": "term", "query": "term"}
+
+
+def read_queries(path, default_kind=None):
+    """Reads queries from a CSV or JSONL file and returns (id, kind, query) tuples.
+
+    Rows without an "id" are numbered by their position in the file.
+    """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    queries = []
+    for number, row in enumerate(rows, 1):
+        row = {_ALIASES.get(key.strip().lower(), key.strip().lower()): value for key, value in row.items() if key}
+        kind = (row.get("kind") or default_kind or "").strip().lower()
+        if kind not in research_core.KINDS:
+            raise ValueError(f"{path}, row {number}: unknown kind {kind!r} (use --kind or a kind column)")
+        query = {field: row.get(field) or "" for field in _QUERY_FIELDS[kind]}
+        if kind == research_core.CHAT:
+            documents = query["documents"]
+            if isinstance(documents, str):
+                documents = [d.strip() for d in documents.split(";") if d.strip()]
+            query["documents"] = documents
+        queries.append((str(row.get("id") or number), kind, query))
+    return queries
+
+
+def read_checkpoint(path):
+    """Returns {id: result} of the queries already answered in an output JSONL file."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # Line cut short by an interrupted run
+            if result.get("status") == "done":
+                done[result["id"]] = result
+    return done
+
+
+def to_markdown(results):
+    """Renders results as one Markdown document with per-item timing."""
+    lines = ["# Research Results", "", f"_{len(results)} queries · generated {time.strftime('%Y-%m-%d %H:%M')}_", ""]
+    for result in results:
+        query = result["query"]
+        title = query.get("question") or query.get("term") or " ".join(filter(None, (query.get("name"), query.get("year"))))
+        lines += [f"## {title}", ""]
+        timing = "cached" if result.get("cached") else f"{result['duration']:.1f}s"
+        lines += [f"_{result['kind']} · {timing}_", ""]
+        if result["status"] == "done":
+            lines.append(result["answer"].strip())
+        else:
+            lines.append(f"> Failed: {result['error']}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run legal research queries from a CSV/JSONL file without the UI.")
+    parser.add_argument("input", help="CSV or JSONL file of queries")
+    parser.add_argument("-o", "--output", required=True, help="results JSONL, also used to resume an interrupted run")
+    parser.add_argument("--markdown", help="also write all results to this Markdown file")
+    parser.add_argument("--kind", choices=research_core.KINDS, help="kind of every query without a kind column")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="queries run concurrently (default %(default)s)")
+    parser.add_argument("--budget", type=int, default=context_packer.DEFAULT_BUDGETS["General Chat"], help="token budget of document context for chat queries")
+    parser.add_argument("--force-refresh", action="store_true", help="ignore cached case law / provision answers")
+    parser.add_argument("--no-resume", action="store_true", help="answer every query again, even if already in the output")
+    args = parser.parse_args(argv)
+
+    queries = read_queries(args.input, args.kind)
+    done = {} if args.no_resume else read_checkpoint(args.output)
+    pending = [q for q in queries if q[0] not in done]
+    print(f"{len(queries)} queries, {len(queries) - len(pending)} already answered, {len(pending)} to run", file=sys.stderr)
+
+    model = llm_backends.create_backend(os.environ.get("GEMINI_API_KEY"))
+    write_lock = threading.Lock()
+    started = time.perf_counter()
+    failed = 0
+    with open(args.output, "w" if args.no_resume else "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(research_core.run_query, model, kind, query, args.force_refresh, args.budget): query_id
+                   for query_id, kind, query in pending}
+        for completed, future in enumerate(as_completed(futures), 1):
+            result = dict(future.result(), id=futures[future])
+            done[result["id"]] = result
+            failed += result["status"] != "done"
+            with write_lock:
+                out.write(json.dumps(result) + "\n")
+                out.flush()  # Checkpoint every result as soon as it is known
+            timing = "cached" if result["cached"] else f"{result['duration']:.1f}s"
+            print(f"[{completed}/{len(pending)}] {result['id']} {result['status']} ({timing})"
+                  + (f": {result['error']}" if result["error"] else ""), file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    print(f"Finished {len(pending)} queries in {elapsed:.1f}s ({failed} failed)", file=sys.stderr)
+    if args.markdown:
+        ordered = [done[query_id] for query_id, _, _ in queries if query_id in done]
+        with open(args.markdown, "w", encoding="utf-8") as f:
+            f.write(to_markdown(ordered))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
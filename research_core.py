@@ -0,0 +1,131 @@
+import os
+import time
+
+import context_builder
+import context_cache
+import context_packer
+import extractors
+import llm_telemetry
+import response_cache
+from legal_prompts import case_law_prompt, provision_prompt
+
+# --- Research Core ---
+# The research flows of the app without Streamlit: prompt building, answer
+# streaming (with telemetry) and cached case law / provision lookups. The UI
+# (legal_chatbot.py) and the headless batch runner (research_cli.py) both use
+# these, so a query gives the same prompt, the same cached answer and the same
+# metrics whichever way it is run.
+
+CASE, PROVISION, CHAT = "case", "provision", "chat"
+KINDS = (CASE, PROVISION, CHAT)
+
+QUESTION_INSTRUCTION = "Based on the context (if relevant) and your general knowledge, answer the following question:\n"
+
+
+def build_prompt(prompt, context="", cached_prefix=None):
+    """Wraps a question with its context.
+
+    With a cached_prefix the document context is already on the model's side, so context only
+    holds what changes per turn (such as chat history).
+    """
+    if cached_prefix is not None:
+        full_prompt = f"{context}\n\n" if context else ""
+        return full_prompt + QUESTION_INSTRUCTION + prompt
+    if context:
+        return f"{context_cache.CONTEXT_HEADER}{context}{context_cache.CONTEXT_FOOTER}\n\n{QUESTION_INSTRUCTION}{prompt}"
+    return prompt
+
+
+def stream_answer(model, prompt, context="", cached_prefix=None, usage=None, kind=CHAT):
+    """Streams the text of the model's answer to prompt, recording the call in llm_telemetry.
+
+    If a usage dict is given, the cached token count reported by the API is stored in it.
+    Errors are raised to the caller.
+    """
+    full_prompt = build_prompt(prompt, context, cached_prefix)
+    timer = llm_telemetry.CallTimer(kind, model.model_name, full_prompt)
+    if cached_prefix is not None:
+        model = context_cache.model_for(cached_prefix, model)
+    if cached_prefix is not None:
+        timer.record.prompt_tokens += cached_prefix.tokens
+    try:
+        for chunk in model.generate_content(full_prompt, stream=True):
+            if getattr(chunk, "usage_metadata", None):
+                timer.add_usage(chunk.usage_metadata)
+                if usage is not None:
+                    usage["cached_tokens"] = getattr(chunk.usage_metadata, "cached_content_token_count", None)
+            if chunk.parts:
+                timer.add_text(chunk.text)
+                yield chunk.text
+        timer.finish()
+    except GeneratorExit:  # The reader stopped before the answer completed
+        timer.finish(cancelled=True)
+        raise
+    except Exception as e:
+        timer.finish(error=e)
+        raise
+
+
+def lookup_prompt(kind, query):
+    """Returns the prompt and the response-cache key parts of a case law or provision query.
+
+    A case query is {"name", "year"}; a provision query is {"term"}.
+    """
+    if kind == CASE:
+        parts = [query.get("name", ""), query.get("year", "")]
+        return case_law_prompt(*parts), parts
+    if kind == PROVISION:
+        return provision_prompt(query["term"]), [query["term"]]
+    raise ValueError(f"Not a lookup kind: {kind}")
+
+
+def document_context_from_files(paths, budget):
+    """Extracts files from disk and packs them into budget tokens like the Full documents chat mode."""
+    pieces = []
+    for path in paths:
+        mime_type = extractors.mime_type_for_extension(os.path.splitext(path)[1])
+        if mime_type is None:
+            raise extractors.ExtractionError(f"unsupported file type: {path}")
+        with open(path, "rb") as f:
+            result = extractors.extract(f.read(), mime_type)
+        pieces.append(context_packer.Piece(os.path.basename(path), result.text))
+    return context_builder.build_document_context(pieces, budget)
+
+
+def run_query(model, kind, query, force_refresh=False, budget=context_packer.DEFAULT_BUDGETS["General Chat"]):
+    """Answers one research query and returns a result dict with the answer and its timing.
+
+    Case law and provision answers go through the shared response cache. A chat query is
+    {"question", "documents": [paths]}; its documents are sent as context.
+    """
+    result = {"kind": kind, "query": query, "status": "done", "answer": "", "cached": False,
+              "error": None, "ttft": None, "duration": None, "started_at": time.time()}
+    started = time.perf_counter()
+    try:
+        if kind == CHAT:
+            context = ""
+            if query.get("documents"):
+                context = document_context_from_files(query["documents"], budget).text
+            stream, cache_key = stream_answer(model, query["question"], context=context, kind=CHAT), None
+        else:
+            prompt, parts = lookup_prompt(kind, query)
+            cache_key = response_cache.cache_key(kind, parts, model.model_name)
+            cached = None if force_refresh else response_cache.get(cache_key)
+            if cached:
+                result["cached"] = True
+                stream = iter([cached["text"]])
+            else:
+                stream = stream_answer(model, prompt, kind=kind)
+        chunks = []
+        for text in stream:
+            if result["ttft"] is None:
+                result["ttft"] = time.perf_counter() - started
+            chunks.append(text)
+        result["answer"] = "".join(chunks)
+        if cache_key and not result["cached"]:
+            response_cache.put(cache_key, result["answer"])
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["duration"] = time.perf_counter() - started
+    return result
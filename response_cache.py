@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from disk_cache import DiskCache
+
+# --- Response Cache ---
+# Caches AI answers to the deterministic Case Law Search and Legal Provision
+# prompts on disk, shared by all sessions. Queries are normalized first, so
+# "Sec. 80 C" and "section 80c" hit the same entry. Entries expire after a
+# TTL, and the least recently used entries are evicted beyond a size cap.
+# Cached answers are replayed as a fast stream so the UI behaves the same.
+
+# Bump when the prompts change so answers to old prompts are no longer used
+PROMPT_VERSION = "1"
+
+CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", os.path.join(".cache", "responses"))
+CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024
+TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_HOURS", "168")) * 3600
+
+REPLAY_CHUNK_CHARS = 80
+REPLAY_DELAY_SECONDS = 0.005
+
+_cache = DiskCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+_SECTION_RE = re.compile(r"\b(?:sections?|secs?\.?|ss?\.|u/s\.?)\s*(?=\d)")
+# "section 80 c" / "section 80-c" -> "section 80c"; only single letters, so not "section 302 ipc" or "section 10 is"
+_SECTION_NUMBER_RE = re.compile(r"\b(section \d+)\s*[-–]?\s*([a-z])(?![a-z])")
+_SUBSECTION_RE = re.compile(r"\s+\(")
+_VERSUS_RE = re.compile(r"\s+(?:vs?\.?|versus)\s+")
+
+
+def normalize_query(text):
+    """Normalizes a search query so trivially different spellings share a cache entry.
+
+    Lower-cases, collapses whitespace, and normalizes section references ("Sec. 80 C",
+    "s. 80-C", "u/s 80C" -> "section 80c"; "10 (1)" -> "10(1)") and "vs."/"versus" -> "v".
+    """
+    text = " ".join(str(text).lower().split()).strip(" .,;:")
+    text = _SECTION_RE.sub("section ", text)
+    text = _SECTION_NUMBER_RE.sub(r"\1\2", text)
+    text = _SUBSECTION_RE.sub("(", text)
+    text = _VERSUS_RE.sub(" v ", text)
+    return text
+
+
+def cache_key(kind, query_parts, model_name=""):
+    """Builds the cache key of a query of a given kind ("case", "provision") for a model."""
+    normalized = [normalize_query(part) if part else "" for part in query_parts]
+    payload = json.dumps([PROMPT_VERSION, kind, model_name, normalized])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(text):
+    """Empty answers are not cached."""
+    return bool(text and text.strip())
+
+
+def _is_fresh(cached):
+    try:
+        record = json.loads(cached)
+    except ValueError:
+        return False
+    return time.time() - record.get("created_at", 0) <= TTL_SECONDS
+
+
+def get(key):
+    """Returns the cached record {"text", "created_at"} for key, or None if missing or expired.
+
+    Expired entries are removed and count as misses.
+    """
+    cached = _cache.get(key, is_valid=_is_fresh)
+    return json.loads(cached) if cached is not None else None
+
+
+def put(key, text):
+    """Stores a complete answer under key."""
+    if is_cacheable(text):
+        _cache.set(key, json.dumps({"text": text, "created_at": time.time()}))
+
+
+def replay_stream(text):
+    """Yields a cached answer in small chunks, so it renders like a live (but fast) stream."""
+    for start in range(0, len(text), REPLAY_CHUNK_CHARS):
+        yield text[start:start + REPLAY_CHUNK_CHARS]
+        time.sleep(REPLAY_DELAY_SECONDS)
+
+
+def caching_stream(stream, key):
+    """Passes a live answer stream through and caches the answer once it has completed.
+
+    stream must raise on errors rather than yield a message: an answer is only cached
+    if the stream ran to its end, never when it failed or the reader stopped early.
+    """
+    chunks = []
+    for chunk in stream:
+        chunks.append(chunk)
+        yield chunk
+    put(key, "".join(chunks))
+
+
+def cache_stats():
+    """Returns hit/miss counters and size of the response cache."""
+    return _cache.stats()
+
+
+def clear_cache():
+    """Removes all cached answers."""
+    _cache.clear()
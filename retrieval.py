@@ -0,0 +1,204 @@
+import collections
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+import document_store
+from pdf_extraction import page_for_offset
+
+# --- Passage Retrieval ---
+# Documents are split into overlapping chunks and indexed in an in-process BM25
+# inverted index when they are extracted. For each chat question only the
+# top-scoring chunks of the session's documents are sent as context, instead of
+# the full text of every file. The index is shared by all sessions, like the
+# document store it is built from; documents not used for a while are dropped
+# from it and re-indexed from the store when needed again.
+
+CHUNK_CHARS = int(os.environ.get("RETRIEVAL_CHUNK_CHARS", "1500"))
+CHUNK_OVERLAP = int(os.environ.get("RETRIEVAL_CHUNK_OVERLAP", "300"))
+TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "8"))
+# Least recently used documents are dropped from the index beyond this many chunks
+MAX_INDEXED_CHUNKS = int(os.environ.get("RETRIEVAL_MAX_INDEXED_CHUNKS", "200000"))
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+
+def tokenize(text):
+    """Lower-cases text and splits it into word tokens, dropping common stopwords."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+@dataclass
+class Chunk:
+    """A passage of a document, located by character offsets into its text."""
+    doc_id: str
+    index: int
+    start: int
+    end: int
+    page: int = None  # One-based page of the chunk start, for paged documents
+
+    def text(self, document_text):
+        return document_text[self.start:self.end]
+
+
+def chunk_document(doc_id, text, page_offsets=None, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Splits text into chunks of about chunk_chars characters that overlap by about overlap characters.
+
+    Chunk boundaries are moved back to the nearest whitespace so words are not cut in half.
+    """
+    chunks = []
+    start = 0
+    step = max(chunk_chars - overlap, 1)
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start + step, end)
+            newline = text.rfind("\n", start + step, end)
+            end = max(space, newline) + 1 or end
+        page = page_for_offset(page_offsets, start) + 1 if page_offsets else None
+        chunks.append(Chunk(doc_id, len(chunks), start, end, page))
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+        # Start the next chunk on a word boundary too
+        boundary = text.find(" ", start, end)
+        if boundary != -1:
+            start = boundary + 1
+    return chunks
+
+
+class BM25Index:
+    """An incremental BM25 inverted index over document chunks."""
+
+    def __init__(self):
+        self._postings = collections.defaultdict(dict)  # term -> {(doc_id, chunk index): term frequency}
+        self._chunks = {}  # doc_id -> list of Chunk
+        self._chunk_lengths = {}  # (doc_id, chunk index) -> number of tokens
+        self._doc_terms = {}  # doc_id -> terms occurring in the document, for removal
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __contains__(self, doc_id):
+        return doc_id in self._chunks
+
+    @property
+    def num_chunks(self):
+        return len(self._chunk_lengths)
+
+    def add_document(self, doc_id, text, page_offsets=None):
+        """Chunks and indexes a document; does nothing if it is already indexed."""
+        if doc_id in self._chunks:
+            return
+        chunks = chunk_document(doc_id, text, page_offsets)
+        # Tokenize outside the lock; only updating the postings needs it
+        chunk_terms = [collections.Counter(tokenize(chunk.text(text))) for chunk in chunks]
+        with self._lock:
+            if doc_id in self._chunks:
+                return
+            terms = set()
+            for chunk, counts in zip(chunks, chunk_terms):
+                key = (doc_id, chunk.index)
+                for term, frequency in counts.items():
+                    self._postings[term][key] = frequency
+                length = sum(counts.values())
+                self._chunk_lengths[key] = length
+                self._total_length += length
+                terms.update(counts)
+            self._chunks[doc_id] = chunks
+            self._doc_terms[doc_id] = terms
+
+    def remove_document(self, doc_id):
+        """Removes a document's chunks from the index."""
+        with self._lock:
+            chunks = self._chunks.pop(doc_id, None)
+            if chunks is None:
+                return
+            for term in self._doc_terms.pop(doc_id):
+                postings = self._postings[term]
+                for chunk in chunks:
+                    postings.pop((doc_id, chunk.index), None)
+                if not postings:
+                    del self._postings[term]
+            for chunk in chunks:
+                self._total_length -= self._chunk_lengths.pop((doc_id, chunk.index))
+
+    def search(self, query, k=TOP_K, doc_ids=None):
+        """Returns up to k (score, Chunk) pairs best matching query, optionally limited to doc_ids."""
+        terms = set(tokenize(query))
+        if doc_ids is not None:
+            doc_ids = set(doc_ids)
+        with self._lock:
+            num_chunks = len(self._chunk_lengths)
+            if not num_chunks or not terms:
+                return []
+            average_length = self._total_length / num_chunks or 1
+            scores = collections.defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (num_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, frequency in postings.items():
+                    if doc_ids is not None and key[0] not in doc_ids:
+                        continue
+                    length = self._chunk_lengths[key]
+                    scores[key] += idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(score, self._chunks[doc_id][index]) for (doc_id, index), score in best]
+
+
+_index = BM25Index()
+_index_lru = collections.OrderedDict()  # doc_id -> None, least recently used first
+_index_lru_lock = threading.Lock()
+
+
+def _mark_used(doc_ids):
+    with _index_lru_lock:
+        for doc_id in doc_ids:
+            _index_lru[doc_id] = None
+            _index_lru.move_to_end(doc_id)
+        while _index.num_chunks > MAX_INDEXED_CHUNKS and len(_index_lru) > 1:
+            evicted, _ = _index_lru.popitem(last=False)
+            _index.remove_document(evicted)
+
+
+def index_document(doc_id, text, page_offsets=None):
+    """Adds a document to the shared index; called when a document is extracted."""
+    _index.add_document(doc_id, text, page_offsets)
+    _mark_used([doc_id])
+
+
+def ensure_indexed(doc_ids):
+    """Indexes documents from the store that are not in the shared index (e.g. after a restart)."""
+    for doc_id in doc_ids:
+        if doc_id not in _index:
+            text = document_store.get_text(doc_id)
+            if text is not None:
+                _index.add_document(doc_id, text, document_store.get_page_offsets(doc_id))
+    _mark_used(doc_ids)
+
+
+def retrieve(query, doc_ids, k=TOP_K, partial_documents=()):
+    """Returns the k best (score, Chunk) pairs for query among the stored documents doc_ids.
+
+    partial_documents are (doc_id, text) pairs of documents still being extracted; they are
+    added to the index for this query only, so their scores use the same term statistics.
+    """
+    doc_ids = list(doc_ids)
+    ensure_indexed(doc_ids)
+    for doc_id, text in partial_documents:
+        _index.add_document(doc_id, text)
+    try:
+        return _index.search(query, k, doc_ids + [doc_id for doc_id, _ in partial_documents])
+    finally:
+        for doc_id, _ in partial_documents:
+            _index.remove_document(doc_id)
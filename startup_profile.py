@@ -0,0 +1,84 @@
+import collections
+import importlib
+import sys
+import threading
+import time
+
+from llm_telemetry import percentile
+
+# --- Startup Profile ---
+# Tab modules and their heavy dependencies (pandas, plotly, the Gemini client)
+# are imported the first time their tab is opened rather than before the first
+# paint. This module times those imports, the cold-start phases of the
+# process, every script run per tab, and every run of a tab's fragment (full
+# page or tab-only), so the sidebar can report what cold start and each rerun
+# cost as more tools are added.
+
+RUN_WINDOW = 200  # Most recent script runs kept per process
+
+_imports = collections.OrderedDict()  # module name -> seconds its first import took
+_cold_start = collections.OrderedDict()  # phase -> seconds, from the first script run of the process
+_runs = collections.deque(maxlen=RUN_WINDOW)  # (tab, seconds)
+_tab_runs = collections.deque(maxlen=RUN_WINDOW)  # (tab, seconds, whether only the tab's fragment reran)
+_lock = threading.Lock()
+
+
+def import_module(name):
+    """Imports a module on first use and records how long the first import took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        _imports.setdefault(name, time.perf_counter() - started)
+    return module
+
+
+def record_cold_start(phase, seconds):
+    """Records a startup phase; only the first script run of the process counts."""
+    with _lock:
+        _cold_start.setdefault(phase, seconds)
+
+
+def record_run(tab, seconds):
+    """Records how long a complete script run showing tab took."""
+    with _lock:
+        _runs.append((tab, seconds))
+
+
+def record_tab_run(tab, seconds, isolated):
+    """Records a run of a tab's body; isolated if only its fragment reran, not the whole page."""
+    with _lock:
+        _tab_runs.append((tab, seconds, isolated))
+
+
+def tab_timing(tab=None):
+    """Returns run counts and p50/p95 seconds of a tab's body (all tabs if tab is None)."""
+    with _lock:
+        runs = [(seconds, isolated) for name, seconds, isolated in _tab_runs if tab is None or name == tab]
+    return {
+        "runs": len(runs),
+        "isolated": sum(1 for _, isolated in runs if isolated),
+        "p50": percentile([seconds for seconds, _ in runs], 50),
+        "p95": percentile([seconds for seconds, _ in runs], 95),
+    }
+
+
+def report():
+    """Returns cold-start phases, first-import times (slowest first) and p50/p95 run time per tab."""
+    with _lock:
+        imports = sorted(_imports.items(), key=lambda item: item[1], reverse=True)
+        cold_start = list(_cold_start.items())
+        runs = list(_runs)
+    by_tab = collections.OrderedDict()
+    for tab, seconds in runs:
+        by_tab.setdefault(tab, []).append(seconds)
+    return {
+        "cold_start": cold_start,
+        "imports": imports,
+        "runs": [
+            {"tab": tab, "runs": len(times), "p50": percentile(times, 50), "p95": percentile(times, 95)}
+            for tab, times in by_tab.items()
+        ],
+    }
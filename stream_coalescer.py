@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+# --- Stream Coalescing ---
+# Every piece of text handed to st.write_stream becomes a websocket delta and a
+# markdown re-render in the browser, and model streams arrive in many small
+# chunks. coalesce() passes the first chunk through immediately (so time to
+# first token is unchanged) and then merges the following chunks until
+# COALESCE_CHARS characters are buffered or COALESCE_SECONDS have passed since
+# the last delta. Text is only released when a chunk arrives or the stream
+# ends, so a slow stream is never delayed by more than its own chunk gaps.
+# Chunks received and deltas sent are counted per answer and per process.
+
+COALESCE_SECONDS = int(os.environ.get("STREAM_COALESCE_MS", "50")) / 1000
+COALESCE_CHARS = int(os.environ.get("STREAM_COALESCE_CHARS", "200"))
+
+_totals = {"answers": 0, "chunks": 0, "deltas": 0}
+_totals_lock = threading.Lock()
+
+
+def coalesce(stream, window_seconds=COALESCE_SECONDS, max_chars=COALESCE_CHARS, counts=None):
+    """Yields the text of stream in fewer, larger pieces.
+
+    If a counts dict is given, its "chunks" and "deltas" entries are updated as the stream
+    is consumed.
+    """
+    if counts is None:
+        counts = {}
+    counts["chunks"] = counts["deltas"] = 0
+    buffer, buffered_chars = [], 0
+    last_delta = None
+    try:
+        for chunk in stream:
+            if not chunk:
+                continue
+            counts["chunks"] += 1
+            buffer.append(chunk)
+            buffered_chars += len(chunk)
+            now = time.perf_counter()
+            if last_delta is None or buffered_chars >= max_chars or now - last_delta >= window_seconds:
+                counts["deltas"] += 1
+                last_delta = now
+                yield "".join(buffer)
+                buffer, buffered_chars = [], 0
+        if buffer:
+            counts["deltas"] += 1
+            yield "".join(buffer)
+    finally:
+        with _totals_lock:
+            _totals["answers"] += 1
+            _totals["chunks"] += counts["chunks"]
+            _totals["deltas"] += counts["deltas"]
+
+
+def coalesce_stats():
+    """Returns answers streamed, chunks received and deltas sent since startup."""
+    with _totals_lock:
+        return dict(_totals)
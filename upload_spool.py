@@ -0,0 +1,161 @@
+import collections
+import hashlib
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; memory is then not recorded
+    resource = None
+
+# --- Spooled Uploads ---
+# Uploaded files are written to a temporary file once and then read through a
+# read-only memory map, so parsers work on the OS page cache instead of several
+# private copies of the bytes. The temporary file is removed as soon as the
+# extraction is finished.
+
+SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None  # None uses the system temp directory
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+# Memory measurements of recent uploads, shared by all sessions of this process
+memory_log = collections.deque(maxlen=200)
+_memory_log_lock = threading.Lock()
+
+
+class SpooledUpload:
+    """An uploaded file spooled to disk and exposed as a zero-copy memoryview."""
+
+    def __init__(self, uploaded_file, name=None):
+        self.name = name or getattr(uploaded_file, "name", "upload")
+        self.type = getattr(uploaded_file, "type", None)
+        self.path = None
+        self.size = 0
+        self.sha256 = None
+        self.buffer = None  # memoryview over the memory-mapped file
+        self._mmap = None
+        self._spool(uploaded_file)
+
+    def _spool(self, uploaded_file):
+        # Streamlit's UploadedFile is a BytesIO; getbuffer() exposes its bytes without copying
+        if hasattr(uploaded_file, "getbuffer"):
+            source = uploaded_file.getbuffer()
+        else:
+            source = memoryview(uploaded_file)
+        digest = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(prefix="upload-", suffix=".spool", dir=SPOOL_DIR)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for start in range(0, len(source), SPOOL_BLOCK_SIZE):
+                    block = source[start:start + SPOOL_BLOCK_SIZE]
+                    digest.update(block)
+                    f.write(block)
+            self.size = len(source)
+        finally:
+            source.release()
+        self.sha256 = digest.hexdigest()
+        if self.size:
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = memoryview(self._mmap)
+        else:
+            self.buffer = memoryview(b"")  # Empty files cannot be memory-mapped
+
+    def __len__(self):
+        return self.size
+
+    def open(self):
+        """Opens an independent binary stream over the spooled bytes."""
+        return open(self.path, "rb")
+
+    def close(self):
+        """Releases the memory map and deletes the temporary file."""
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # A parser still holds a slice; the map is unmapped when that is garbage collected
+            self._mmap = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_binary(content):
+    """Returns a binary stream over bytes-like content or a SpooledUpload, without copying."""
+    if isinstance(content, SpooledUpload):
+        return content.open()
+    if isinstance(content, bytes):
+        return BytesIO(content)  # BytesIO shares the buffer of a bytes object until written to
+    return BytesIO(memoryview(content))
+
+
+def content_buffer(content):
+    """Returns a memoryview over bytes-like content or a SpooledUpload."""
+    if isinstance(content, SpooledUpload):
+        return content.buffer
+    return memoryview(content)
+
+
+def current_rss():
+    """Returns the resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports kilobytes
+
+
+class MemoryProbe:
+    """Records RSS before/after a block of work and the process peak RSS reached during it."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __enter__(self):
+        self.started = time.time()
+        self.rss_before = current_rss()
+        self.peak_before = peak_rss()
+        return self
+
+    def __exit__(self, *exc_info):
+        peak_after = peak_rss()
+        entry = {
+            "name": self.name,
+            "size": self.size,
+            "time": self.started,
+            "seconds": time.time() - self.started,
+            "rss_before": self.rss_before,
+            "rss_after": current_rss(),
+            "peak_rss": peak_after,
+            # How much this upload raised the process high-water mark (0 if it stayed below it)
+            "peak_increase": (peak_after - self.peak_before) if peak_after is not None else None,
+        }
+        with _memory_log_lock:
+            memory_log.append(entry)